@@ -1,57 +1,142 @@
-from app.utils import fonts, colors, logo_position, logo_colors
+from app.utils import fonts, colors, logo_position, logo_colors, decks, dedup
+import tempfile
 
+# Categories assessed for every slide.
+CHECKS = ("Font style", "Logo Safe Zone", "Logo Color", "Color palette")
 
-def assess_slide_compliance(image_path, pdf_path, api_key):
+# Checks that re-exports and small text edits are likely to change; the logo checks are reused from a near-identical slide.
+NEAR_DUPLICATE_RECHECKS = ("Font style", "Color palette")
+
+
+def analyze_brand_kit(pdf_path, api_key):
     """
-    Calls all functions to asssess one by one if brand criteria is met.
+    Extracts everything the checks need from the brand kit once, so it can be shared across many slides.
 
     pdf_path: Path to the pdf file.
-    slide_path:  Path to the slide image to be assessed.
     api_key: apy key to extract font names from Google Fonts API.
 
-    Returns: total score [0,4], and dictionary of explanations. 
+    Returns: dictionary with the brand kit fonts, colors, logo colors and logo guidelines.
     """
+    return {
+        "fonts": fonts.analyze_pdf_fonts(pdf_path, fonts.load_font_model(), api_key),
+        "colors": colors.extract_colors_from_pdf(pdf_path),
+        "logo_colors": logo_colors.extract_logo_colors_from_pdf(pdf_path),
+        "logo_guidelines": logo_position.extract_brand_kit_text(pdf_path),
+    }
 
-    reasons = {}
-    score = 0
+
+def run_checks(image_path, pdf_path, api_key, brand_kit=None, checks=None):
+    """
+    Calls all functions to asssess one by one if brand criteria is met.
+
+    pdf_path: Path to the pdf file.
+    slide_path:  Path to the slide image to be assessed, or the PIL image itself.
+    api_key: apy key to extract font names from Google Fonts API.
+    brand_kit: Brand kit already analysed with `analyze_brand_kit`, if available.
+    checks: Categories to run (see CHECKS), all of them by default.
+
+    Returns: dictionary of category -> (score, explanation).
+    """
+    brand_kit = brand_kit or {}
+    checks = CHECKS if checks is None else checks
+    results = {}
 
     # 1. Font Style
-    try:
-        font_score, font_reason = fonts.verify_fonts(pdf_path, image_path, api_key)
-    except Exception as e:
-        font_score, font_reason = 0, f"Font check failed: {str(e)}"
-    reasons['Font style'] = font_reason
-    score += font_score
+    if "Font style" in checks:
+        try:
+            font_score, font_reason = fonts.verify_fonts(pdf_path, image_path, api_key, brand_kit.get("fonts"))
+        except Exception as e:
+            font_score, font_reason = 0, f"Font check failed: {str(e)}"
+        results['Font style'] = (font_score, font_reason)
 
-    
     # 2. Logo Safe Zone 
-    try:
-        score_logo_position, explanation_logo_position = logo_position.check_logo_position(image_path, pdf_path)
-    except Exception as e:
-        score_logo_position, explanation_logo_position = 0, f"Logo position check failed: {str(e)}"
-    reasons["Logo Safe Zone"] = explanation_logo_position
-    score += score_logo_position
+    if "Logo Safe Zone" in checks:
+        try:
+            score_logo_position, explanation_logo_position = logo_position.check_logo_position(image_path, pdf_path, brand_kit.get("logo_guidelines"))
+        except Exception as e:
+            score_logo_position, explanation_logo_position = 0, f"Logo position check failed: {str(e)}"
+        results["Logo Safe Zone"] = (score_logo_position, explanation_logo_position)
 
     # 3. Logo Colors 
-    try:
-        score_logo_color, explanation_logo_color = logo_colors.check_logo_colors(pdf_path, image_path)
-    except Exception as e:
-        score_logo_color, explanation_logo_color = 0, f"Logo color check failed: {str(e)}"
-    reasons["Logo Color"] = explanation_logo_color
-    score += score_logo_color
+    if "Logo Color" in checks:
+        try:
+            score_logo_color, explanation_logo_color = logo_colors.check_logo_colors(image_path, pdf_path, brand_kit.get("logo_colors"))
+        except Exception as e:
+            score_logo_color, explanation_logo_color = 0, f"Logo color check failed: {str(e)}"
+        results["Logo Color"] = (score_logo_color, explanation_logo_color)
     
     # 4. Overall Color Palette
-    try:
-        score_color, explanation_color = colors.analyze_colors(pdf_path, image_path)
-    except Exception as e:
-        score_color, explanation_color = 0, f"Color palette check failed: {str(e)}"
-    reasons["Color palette"] = explanation_color
-    score += score_color
+    if "Color palette" in checks:
+        try:
+            score_color, explanation_color = colors.analyze_colors(pdf_path, image_path, brand_kit.get("colors"))
+        except Exception as e:
+            score_color, explanation_color = 0, f"Color palette check failed: {str(e)}"
+        results["Color palette"] = (score_color, explanation_color)
+
+    return results
+
 
+def summarize_checks(results):
+    """
+    Adds up the results of the individual checks.
+
+    results: dictionary of category -> (score, explanation), as returned by `run_checks`.
 
+    Returns: total score [0,4], and dictionary of explanations.
+    """
+    score = sum(check_score for check_score, _ in results.values())
+    reasons = {category: reason for category, (_, reason) in results.items()}
     return score, reasons
-    
-   
+
+
+def assess_slide_compliance(image_path, pdf_path, api_key, brand_kit=None):
+    """
+    Calls all functions to asssess one by one if brand criteria is met.
+
+    pdf_path: Path to the pdf file.
+    slide_path:  Path to the slide image to be assessed, or the PIL image itself.
+    api_key: apy key to extract font names from Google Fonts API.
+    brand_kit: Brand kit already analysed with `analyze_brand_kit`, if available.
+
+    Returns: total score [0,4], and dictionary of explanations. 
+    """
+    return summarize_checks(run_checks(image_path, pdf_path, api_key, brand_kit))
+
+
+def assess_slide_compliance_dedup(image_path, pdf_path, api_key, index, mode="reuse", max_distance=dedup.DEFAULT_MAX_DISTANCE, brand_kit=None):
+    """
+    Assesses a slide, reusing the results of a near-identical slide already assessed with the same brand kit.
+
+    image_path: Path to the slide image to be assessed.
+    pdf_path: Path to the pdf file.
+    api_key: apy key to extract font names from Google Fonts API.
+    index: `dedup.ResultIndex` with the previous results. New results are added to it, unless mode is "off".
+    mode: "off" always recomputes, "reuse" returns the match as is, "partial" only recomputes
+          the checks that small variants are likely to change (NEAR_DUPLICATE_RECHECKS).
+    max_distance: Maximum Hamming distance between the slide hashes to accept a match.
+    brand_kit: Brand kit already analysed with `analyze_brand_kit`, if available.
+
+    Returns: total score [0,4], dictionary of explanations, and the Hamming distance of the reused match (None if recomputed).
+    """
+    key = dedup.slide_hash(image_path)
+    brand_kit_key = dedup.file_digest(pdf_path)
+    match = index.lookup(key, brand_kit_key, max_distance) if mode != "off" else None
+
+    if match is None:
+        results = run_checks(image_path, pdf_path, api_key, brand_kit)
+        if mode != "off":
+            index.add(key, brand_kit_key, results)
+        score, reasons = summarize_checks(results)
+        return score, reasons, None
+
+    distance, record = match
+    results = {category: tuple(result) for category, result in record["checks"].items()}
+    if mode == "partial" and distance > 0:
+        results.update(run_checks(image_path, pdf_path, api_key, brand_kit, NEAR_DUPLICATE_RECHECKS))
+        index.add(key, brand_kit_key, results)
+    score, reasons = summarize_checks(results)
+    return score, reasons, distance
+
 
 # Main
 def assessmentllm(slide_image_path, brand_pdf_path, api_key):
@@ -72,3 +157,72 @@ def assessmentllm(slide_image_path, brand_pdf_path, api_key):
     return score, feedback
 
 
+def assess_deck_compliance(deck_path, brand_pdf_path, api_key, max_in_flight=2):
+    """
+    Assesses every page of a slide deck, rendering the next pages while the current one is scored.
+
+    deck_path: Path to the deck (PDF or PPTX export) to be assessed.
+    brand_pdf_path: Path to the brand kit pdf file.
+    api_key: apy key to extract font names from Google Fonts API.
+    max_in_flight: Maximum number of rendered pages in memory at once.
+
+    Returns: generator of (page_number, score, dictionary of explanations), one per page.
+    """
+    # The brand kit is analysed once and shared by all pages.
+    brand_kit = analyze_brand_kit(brand_pdf_path, api_key)
+    with tempfile.TemporaryDirectory(prefix="deck_") as output_dir:
+        pages = decks.prefetch_pages(decks.iter_deck_pages(deck_path, output_dir), max_in_flight)
+        try:
+            for page_number, page_image in pages:
+                score, reasons = assess_slide_compliance(page_image, brand_pdf_path, api_key, brand_kit)
+                # Each page is released as soon as it has been scored, before the next one is rendered.
+                del page_image
+                yield page_number, score, reasons
+        finally:
+            pages.close()
+
+
+def summarize_deck_results(page_results):
+    """
+    Aggregates per-page results of a deck assessment.
+
+    page_results: iterable of (page_number, score, dictionary of explanations).
+
+    Returns: dictionary with the per-page results and the aggregate scores.
+    """
+    pages = []
+    total_score = 0
+    for page_number, score, reasons in page_results:
+        pages.append({"page": page_number, "value": score, "reasoning": reasons})
+        total_score += score
+
+    num_pages = len(pages)
+    return {
+        "pages": pages,
+        "num_pages": num_pages,
+        "total_value": total_score,
+        "max_value": 4 * num_pages,
+        "mean_value": total_score / num_pages if num_pages else 0,
+        "fully_compliant_pages": sum(1 for page in pages if page["value"] == 4),
+    }
+
+
+def assessmentllm_deck(deck_path, brand_pdf_path, api_key, max_in_flight=2):
+    """
+    Main function for the assessment of a multi-page deck.
+
+    deck_path: Path to the deck (PDF or PPTX export) to be assessed.
+    brand_pdf_path: Path to the brand kit pdf file.
+    api_key: apy key to extract font names from Google Fonts API.
+    max_in_flight: Maximum number of rendered pages in memory at once.
+
+    Returns: dictionary with per-page scores and explanations plus the aggregate scores.
+    """
+    def report(page_results):
+        for page_number, score, feedback in page_results:
+            print(f"--- Page {page_number} Brand Compliance Score: {score}/4 ---")
+            yield page_number, score, feedback
+
+    summary = summarize_deck_results(report(assess_deck_compliance(deck_path, brand_pdf_path, api_key, max_in_flight)))
+    print(f"--- Deck Brand Compliance Score: {summary['total_value']}/{summary['max_value']} ---\n")
+    return summary
@@ -2,33 +2,94 @@ import fitz  # PyMuPDF for PDF processing
 from PIL import Image
 import numpy as np
 from transformers import pipeline, GPT2Tokenizer
+from collections import Counter
 import os
+from app.utils import scheduler, rasters
 
-def extract_colors_from_pdf(pdf_path):
+# Number of image rows analysed at once, which bounds the temporary memory of the color analysis.
+STRIP_ROWS = 256
+
+# Number of most frequent colors whose pixel counts are tracked, to list the dominant colors first.
+TRACKED_COLORS = 1024
+
+
+def new_color_set():
+    """
+    Creates an empty set of 24-bit RGB colors: a presence bitset (2 MB, whatever the image size) and
+    the approximate pixel counts of the most frequent colors.
+
+    Returns: (bitset as a NumPy uint8 array of 2**21 bytes, Counter of pixel counts by color code).
+    """
+    return np.zeros(1 << 21, dtype=np.uint8), Counter()
+
+
+def add_colors(color_set, rgb_array, strip_rows=STRIP_ROWS):
+    """
+    Adds the pixel colors of an image to a color set, a strip of rows at a time.
+
+    color_set: color set from `new_color_set`, updated in place.
+    rgb_array: NumPy array of shape (height, width, 3) with the image pixels.
+    strip_rows: Number of rows per strip, None to process the whole image at once.
+    """
+    present, counts = color_set
+    strip_rows = strip_rows or max(1, rgb_array.shape[0])
+    for top in range(0, rgb_array.shape[0], strip_rows):
+        strip = rgb_array[top:top + strip_rows].astype(np.uint32)
+        codes = (strip[..., 0] << 16) | (strip[..., 1] << 8) | strip[..., 2]
+        unique_codes, strip_counts = np.unique(codes, return_counts=True)
+        if not len(unique_codes):
+            continue
+
+        # Codes are sorted, so the bits falling in the same byte of the bitset are next to each other
+        byte_index = unique_codes >> 3
+        bits = np.left_shift(1, unique_codes & 7).astype(np.uint8)
+        starts = np.flatnonzero(np.concatenate(([True], byte_index[1:] != byte_index[:-1])))
+        present[byte_index[starts]] |= np.bitwise_or.reduceat(bits, starts)
+
+        # Only the most frequent colors of the strip are counted, keeping the counter small
+        if len(unique_codes) > TRACKED_COLORS:
+            top_colors = np.argpartition(-strip_counts, TRACKED_COLORS - 1)[:TRACKED_COLORS]
+            unique_codes, strip_counts = unique_codes[top_colors], strip_counts[top_colors]
+        counts.update(dict(zip(unique_codes.tolist(), strip_counts.tolist())))
+        if len(counts) > 2 * TRACKED_COLORS:
+            kept = counts.most_common(TRACKED_COLORS)
+            counts.clear()
+            counts.update(dict(kept))
+
+
+def colors_to_hex(color_set):
+    """
+    Lists the colors of a color set, most frequent first, then the other colors present by color code.
+
+    color_set: color set from `new_color_set`.
+
+    Returns: list of detected colors in hex format, most frequent first.
+    """
+    present, counts = color_set
+    # Only the non-empty bytes of the bitset are unpacked
+    byte_index = np.flatnonzero(present)
+    bits = np.unpackbits(present[byte_index, None], axis=1, bitorder="little").astype(bool)
+    codes = (byte_index[:, None] * 8 + np.arange(8))[bits]
+
+    ranked = [code for code, _ in counts.most_common()]
+    others = codes[~np.isin(codes, ranked)]
+    return ["#{:06x}".format(code) for code in ranked + others.tolist()]
+
+
+def extract_colors_from_pdf(pdf_path, strip_rows=STRIP_ROWS):
     """
     Extract primary and secondary colors from the brand kit PDF.
     
     pdf_path: Path to the pdf file.
+    strip_rows: Number of rows analysed at once, None to analyse each page at once.
     
-    Returns: list of detected colors in hex format.
+    Returns: list of detected colors in hex format, most frequent first.
     """
-    doc = fitz.open(pdf_path)
-    extracted_colors = set()
+    color_set = new_color_set()
     try: 
-        for page_number in range(len(doc)):
-            page = doc[page_number]
-            pix = page.get_pixmap()  # Convert page to an image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            # Convert the image to a NumPy array for pixel analysis
-            img_array = np.array(img)
-            img_array = img_array.reshape(-1, 3)  # Flatten the image array
-
-            # Extract unique colors and convert to hex
-            unique_colors = np.unique(img_array, axis=0)
-            for color in unique_colors:
-                hex_color = "#{:02x}{:02x}{:02x}".format(color[0], color[1], color[2])
-                extracted_colors.add(hex_color)
+        # Pages are rendered to RGB (or reused from the page store) and their pixels read in place, strip by strip
+        for page_number, raster in rasters.page_store.iter_pages(pdf_path, mode="RGB"):
+            add_colors(color_set, raster.array, strip_rows)
     except FileNotFoundError:
         print(f"PDF file not found: {pdf_path}")
     except fitz.FileDataError as e:
@@ -39,30 +100,30 @@ def extract_colors_from_pdf(pdf_path):
         return []
 
 
-    return list(extracted_colors)
+    return colors_to_hex(color_set)
 
 
-def extract_colors_from_slide(slide_path):
+def extract_colors_from_slide(slide_path, strip_rows=STRIP_ROWS):
     """
     Extract colors used in the slide image.
 
-    slide_path: Path to the slide image to be assessed. 
+    slide_path: Path to the slide image to be assessed, or the PIL image itself. 
+    strip_rows: Number of rows analysed at once, None to analyse the whole image at once.
 
-    Returns: list of detected colors in hex format.
+    Returns: list of detected colors in hex format, most frequent first.
     """
     try:
-        img = Image.open(slide_path).convert("RGB")
-        img_array = np.array(img)
-        img_array = img_array.reshape(-1, 3)  # Flatten the image array
-
-        # Extract unique colors and convert to hex
-        unique_colors = np.unique(img_array, axis=0)
-        extracted_colors = set()
-        for color in unique_colors:
-            hex_color = "#{:02x}{:02x}{:02x}".format(color[0], color[1], color[2])
-            extracted_colors.add(hex_color)
-
-        return list(extracted_colors)
+        img = slide_path if isinstance(slide_path, Image.Image) else Image.open(slide_path)
+        width, height = img.size
+        color_set = new_color_set()
+
+        # Convert and count the image a strip at a time, so no full-size RGB copy or sort is needed
+        strip_rows = strip_rows or height
+        for top in range(0, height, strip_rows):
+            strip = img.crop((0, top, width, min(height, top + strip_rows))).convert("RGB")
+            add_colors(color_set, np.asarray(strip), None)
+
+        return colors_to_hex(color_set)
     except FileNotFoundError:
         print(f"Error: Image file not found at '{slide_path}'")
         return []
@@ -98,7 +159,8 @@ def analyze_colors_with_llm(pdf_colors, slide_colors):
         inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=max_length)
 
         # Generate a response
-        response = llm(prompt, max_new_tokens=50, num_return_sequences=1, pad_token_id=50256)
+        with scheduler.model_slot():
+            response = llm(prompt, max_new_tokens=50, num_return_sequences=1, pad_token_id=50256)
         output = response[0]["generated_text"]
 
         # Parse the LLM's response
@@ -111,17 +173,19 @@ def analyze_colors_with_llm(pdf_colors, slide_colors):
         print(error_message)
         return None, error_message
 
-def analyze_colors(pdf_path, slide_path):
+def analyze_colors(pdf_path, slide_path, pdf_colors=None):
     """
     Main function to analyze color compliance.
 
     pdf_path: Path to the pdf file.
-    slide_path:  Path to the slide image to be assessed.
+    slide_path:  Path to the slide image to be assessed, or the PIL image itself.
+    pdf_colors: Colors already extracted from the brand kit, if available (skips the pdf analysis).
 
     Returns: 1 if the colors comply with the brand kit, 0 otherwise. And an explanation.
     """
     # Extract colors from the brand kit PDF
-    pdf_colors = extract_colors_from_pdf(pdf_path)
+    if pdf_colors is None:
+        pdf_colors = extract_colors_from_pdf(pdf_path)
 
     # Extract colors used in the slide image
     slide_colors = extract_colors_from_slide(slide_path)
@@ -0,0 +1,133 @@
+import fitz  # PyMuPDF
+import os
+import queue
+import pathlib
+import shutil
+import subprocess
+import threading
+from os.path import basename, splitext
+from app.utils import rasters
+
+# Extensions accepted as multi-page slide decks.
+DECK_EXTENSIONS = (".pdf", ".pptx", ".ppt", ".odp")
+
+# Resolution used to render each deck page before it is assessed.
+DECK_RENDER_DPI = 150
+
+
+def is_deck(path):
+    """
+    Checks if a file is a slide deck (PDF or presentation export) rather than a single image.
+
+    path: Path to the uploaded file.
+
+    Returns: True if the file extension belongs to a deck format.
+    """
+    return splitext(path)[1].lower() in DECK_EXTENSIONS
+
+
+def convert_presentation_to_pdf(presentation_path, output_dir):
+    """
+    Converts a PPTX/PPT/ODP presentation to PDF using a headless LibreOffice.
+
+    presentation_path: Path to the presentation file.
+    output_dir: Directory where the converted PDF is written.
+
+    Returns: path to the converted PDF.
+    """
+    soffice = shutil.which("soffice") or shutil.which("libreoffice")
+    if soffice is None:
+        raise RuntimeError("LibreOffice is required to read presentation decks, but 'soffice' was not found.")
+
+    # Each conversion gets its own LibreOffice profile: concurrent runs sharing the default one fail silently
+    profile_uri = pathlib.Path(output_dir, "lo_profile").resolve().as_uri()
+    subprocess.run(
+        [soffice, f"-env:UserInstallation={profile_uri}", "--headless", "--convert-to", "pdf", "--outdir", output_dir, presentation_path],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    pdf_path = os.path.join(output_dir, splitext(basename(presentation_path))[0] + ".pdf")
+    if not os.path.exists(pdf_path):
+        raise RuntimeError(f"Could not convert presentation '{presentation_path}' to PDF.")
+    return pdf_path
+
+
+def iter_deck_pages(deck_path, output_dir, dpi=DECK_RENDER_DPI):
+    """
+    Lazily renders every page of a deck in memory, one page at a time.
+
+    deck_path: Path to the deck (PDF or presentation export).
+    output_dir: Directory where presentations are converted to PDF.
+    dpi: Render resolution.
+
+    Returns: generator of (page_number, PIL image), page numbers starting at 1.
+    """
+    pdf_path = deck_path
+    if splitext(deck_path)[1].lower() != ".pdf":
+        pdf_path = convert_presentation_to_pdf(deck_path, output_dir)
+
+    with rasters.fitz_lock:
+        doc = fitz.open(pdf_path)
+        num_pages = len(doc)
+    try:
+        for page_number in range(num_pages):
+            # Rendered once straight to RGB, and shared by all the checks of the page
+            with rasters.fitz_lock:
+                image = rasters.render_page(doc[page_number], dpi, "RGB").to_image()
+            yield page_number + 1, image
+    finally:
+        with rasters.fitz_lock:
+            doc.close()
+
+
+def prefetch_pages(pages, max_in_flight=2):
+    """
+    Renders pages in a background thread so rendering overlaps with the assessment of earlier pages
+    (PyMuPDF calls themselves are serialised by `rasters.fitz_lock`, only the model work runs alongside).
+
+    At most `max_in_flight` rendered pages exist at once, counting the one being assessed: a page is only
+    rendered once the consumer asks for the page after an assessed one (and has dropped its reference to it).
+
+    pages: generator of (page_number, page image), as returned by `iter_deck_pages`.
+    max_in_flight: Maximum number of rendered pages alive at once (2 or more to overlap rendering and assessment).
+
+    Returns: generator of (page_number, page image) in page order.
+    """
+    slots = threading.Semaphore(max(1, max_in_flight))
+    buffer = queue.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def producer():
+        try:
+            while not stop.is_set():
+                # Wait for a free slot before rendering the next page, but wake up if the consumer stops early.
+                if not slots.acquire(timeout=0.1):
+                    continue
+                item = next(pages, None)
+                if item is None:
+                    break
+                buffer.put(item)
+        except Exception as e:
+            buffer.put(e)
+        finally:
+            pages.close()
+            buffer.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            # The previous page has been assessed, its slot is free for the next render.
+            del item
+            slots.release()
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,262 @@
+from PIL import Image
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Default maximum Hamming distance (out of 128 bits) for two slides to count as near-identical.
+DEFAULT_MAX_DISTANCE = 10
+
+# Maximum number of results kept per brand kit, and of brand kits kept (least recently used first out).
+RESULT_INDEX_MAX_RECORDS = int(os.getenv("RESULT_INDEX_MAX_RECORDS", "10000"))
+RESULT_INDEX_MAX_BRAND_KITS = int(os.getenv("RESULT_INDEX_MAX_BRAND_KITS", "100"))
+
+# Side of the square hash grid: each hash has HASH_SIZE * HASH_SIZE bits.
+HASH_SIZE = 8
+
+# Side of the downscaled slide the DCT of the pHash is computed on.
+PHASH_IMAGE_SIZE = 32
+
+
+def _dct_matrix(n):
+    """
+    Builds the orthonormal DCT-II matrix of size n x n.
+    """
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def _bits_to_int(bits):
+    """
+    Packs a boolean array into an integer, most significant bit first.
+    """
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image):
+    """
+    Difference hash: compares neighbouring pixels of a downscaled grayscale slide.
+
+    image: PIL image of the slide.
+
+    Returns: 64-bit hash as an integer.
+    """
+    small = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(image):
+    """
+    Perceptual hash: signs of the low frequencies of the DCT of a downscaled grayscale slide.
+
+    image: PIL image of the slide.
+
+    Returns: 64-bit hash as an integer.
+    """
+    small = np.asarray(image.convert("L").resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.BILINEAR), dtype=np.float64)
+    low_frequencies = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only reflects the overall brightness, so it is left out of the median.
+    median = np.median(low_frequencies[1:])
+    return _bits_to_int(low_frequencies > median)
+
+
+def slide_hash(slide_path):
+    """
+    Computes the combined perceptual hash of a slide (pHash in the high bits, dHash in the low bits).
+
+    slide_path: Path to the slide image.
+
+    Returns: 128-bit hash as an integer.
+    """
+    with Image.open(slide_path) as image:
+        # Decoding a reduced version is enough for a 32x32 hash and much cheaper for large JPEGs.
+        image.draft("RGB", (PHASH_IMAGE_SIZE * 4, PHASH_IMAGE_SIZE * 4))
+        image = image.convert("RGB")
+        return (phash(image) << (HASH_SIZE * HASH_SIZE)) | dhash(image)
+
+
+def hamming_distance(a, b):
+    """
+    Number of differing bits between two hashes.
+    """
+    return bin(a ^ b).count("1")
+
+
+def file_digest(path):
+    """
+    Exact content hash of a file, used to identify brand kits.
+
+    path: Path to the file.
+
+    Returns: sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance, so a lookup only visits the branches that can hold a match.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, item):
+        """
+        Adds an item under the given hash.
+        """
+        node = [key, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key, max_distance):
+        """
+        Finds all items whose hash is within max_distance of the given hash.
+
+        Returns: list of (distance, item), closest first.
+        """
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, item, children = stack.pop()
+            distance = hamming_distance(key, node_key)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            # Triangle inequality: only children at distance [d - max, d + max] can hold matches.
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class ResultIndex:
+    """
+    Index of previous assessment results, searchable by perceptual hash of the slide per brand kit.
+
+    The index is bounded: past `max_records` results of a brand kit the oldest half is dropped, and past
+    `max_brand_kits` brand kits the least recently used one is dropped.
+
+    path: Optional JSONL file where results are persisted and reloaded from.
+    max_records: Maximum number of results kept per brand kit.
+    max_brand_kits: Maximum number of brand kits kept.
+    """
+
+    def __init__(self, path=None, max_records=RESULT_INDEX_MAX_RECORDS, max_brand_kits=RESULT_INDEX_MAX_BRAND_KITS):
+        self.path = path
+        self.max_records = max(1, max_records)
+        self.max_brand_kits = max(1, max_brand_kits)
+        self.brand_kits = OrderedDict()  # brand kit -> (BKTree, list of (key, record), oldest first)
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            dropped = False
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    dropped |= self._insert(int(record["hash"], 16), record)
+            if dropped:
+                self._save()
+
+    def _insert(self, key, record):
+        """
+        Adds a record, dropping the oldest ones past the limits of the index.
+
+        Returns: True if records were dropped.
+        """
+        brand_kit = record["brand_kit"]
+        if brand_kit not in self.brand_kits:
+            self.brand_kits[brand_kit] = (BKTree(), [])
+        self.brand_kits.move_to_end(brand_kit)
+        tree, records = self.brand_kits[brand_kit]
+        tree.add(key, record)
+        records.append((key, record))
+
+        dropped = False
+        if len(records) > self.max_records:
+            # BK-trees cannot delete: the tree is rebuilt from the newest half of the records.
+            records = records[-max(1, self.max_records // 2):]
+            tree = BKTree()
+            for record_key, kept in records:
+                tree.add(record_key, kept)
+            self.brand_kits[brand_kit] = (tree, records)
+            dropped = True
+        while len(self.brand_kits) > self.max_brand_kits:
+            self.brand_kits.popitem(last=False)
+            dropped = True
+        return dropped
+
+    def _save(self):
+        """
+        Rewrites the JSONL file with the records kept in the index.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for _, records in self.brand_kits.values():
+                for _, record in records:
+                    f.write(json.dumps(record, default=str) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def add(self, key, brand_kit_key, checks):
+        """
+        Stores the results of one assessment.
+
+        key: Perceptual hash of the slide, from `slide_hash`.
+        brand_kit_key: Identifier of the brand kit, from `file_digest`.
+        checks: dictionary of category -> [score, explanation].
+        """
+        record = {"hash": format(key, "x"), "brand_kit": brand_kit_key, "checks": checks}
+        with self.lock:
+            dropped = self._insert(key, record)
+            if self.path:
+                if dropped:
+                    self._save()
+                else:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(record, default=str) + "\n")
+
+    def lookup(self, key, brand_kit_key, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        Finds the closest previous result for a near-identical slide assessed with the same brand kit.
+
+        key: Perceptual hash of the slide, from `slide_hash`.
+        brand_kit_key: Identifier of the brand kit, from `file_digest`.
+        max_distance: Maximum Hamming distance between the hashes.
+
+        Returns: (distance, record) of the closest match, or None.
+        """
+        with self.lock:
+            if brand_kit_key not in self.brand_kits:
+                return None
+            self.brand_kits.move_to_end(brand_kit_key)
+            matches = self.brand_kits[brand_kit_key][0].search(key, max_distance)
+        return matches[0] if matches else None
@@ -0,0 +1,220 @@
+from PIL import Image, ImageDraw, ImageFont
+import matplotlib.font_manager as fm
+import numpy as np
+import torch
+import argparse
+import functools
+import json
+import os
+
+# Directory with the precomputed glyph embeddings, built offline with `python -m app.utils.font_index`.
+FONT_INDEX_DIR = os.getenv("FONT_INDEX_DIR", "font_index")
+
+# Size every text crop is normalised to before being embedded (height, width).
+CROP_HEIGHT = 48
+CROP_WIDTH = 192
+
+# Texts rendered with every catalogued font to build its reference samples.
+SAMPLE_TEXTS = ["Hamburgefonstiv", "Brand Guidelines", "The quick brown fox", "ABCDEFG 0123456"]
+
+# Number of nearest reference samples voting for the font of each crop.
+TOP_K = 5
+
+# Minimum cosine similarity for a crop to be attributed to a font.
+MIN_SIMILARITY = 0.5
+
+# Number of reference rows compared at once, bounding the float32 copy of the memory-mapped matrix.
+SEARCH_CHUNK_ROWS = 16384
+
+
+def normalize_glyph_crop(image):
+    """
+    Normalises a text crop: grayscale, dark text on white, trimmed to the ink and resized to a fixed size.
+
+    image: PIL image of a text crop.
+
+    Returns: uint8 array of shape (CROP_HEIGHT, CROP_WIDTH).
+    """
+    gray = np.asarray(image.convert("L"), dtype=np.uint8)
+    # Light text on a dark background is inverted so all crops look alike.
+    if np.median(gray) < 128:
+        gray = 255 - gray
+
+    ink = np.argwhere(gray < 160)
+    if len(ink):
+        (top, left), (bottom, right) = ink.min(axis=0), ink.max(axis=0) + 1
+        gray = gray[top:bottom, left:right]
+
+    height, width = gray.shape
+    new_width = max(1, min(CROP_WIDTH, round(width * CROP_HEIGHT / max(height, 1))))
+    resized = Image.fromarray(gray).resize((new_width, CROP_HEIGHT), Image.BILINEAR)
+    canvas = Image.new("L", (CROP_WIDTH, CROP_HEIGHT), 255)
+    canvas.paste(resized, (0, 0))
+    return np.asarray(canvas)
+
+
+def embed_crops(crops, model, batch_size=64):
+    """
+    Embeds text crops with the vision backbone in batches.
+
+    crops: list of PIL images of text crops.
+    model: backbone returning one feature vector per image (ResNet-18 without its classifier).
+    batch_size: Number of crops per forward pass.
+
+    Returns: float32 array of L2-normalised embeddings, one row per crop.
+    """
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(crops), batch_size):
+            batch = np.stack([normalize_glyph_crop(crop) for crop in crops[start:start + batch_size]])
+            tensor = torch.from_numpy(batch).float().div_(255).sub_(0.5).div_(0.5)
+            tensor = tensor.unsqueeze(1).expand(-1, 3, -1, -1)
+            features = model(tensor).reshape(len(batch), -1).numpy()
+            embeddings.append(features)
+    embeddings = np.concatenate(embeddings).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+    return embeddings
+
+
+def render_font_samples(font_path):
+    """
+    Renders the reference texts with one font file.
+
+    font_path: Path to a TrueType/OpenType font file.
+
+    Returns: (family name, list of PIL images), or (None, []) if the font cannot be used.
+    """
+    try:
+        font = ImageFont.truetype(font_path, CROP_HEIGHT)
+        family = font.getname()[0]
+    except Exception:
+        return None, []
+
+    samples = []
+    for text in SAMPLE_TEXTS:
+        left, top, right, bottom = font.getbbox(text)
+        if right <= left or bottom <= top:
+            continue
+        image = Image.new("L", (right - left + 8, bottom - top + 8), 255)
+        ImageDraw.Draw(image).text((4 - left, 4 - top), text, font=font, fill=0)
+        samples.append(image)
+    return family, samples
+
+
+def build_font_index(output_dir, model, font_dirs=None):
+    """
+    Builds the glyph-embedding index of every available font and saves it to disk.
+
+    output_dir: Directory where the index is written.
+    model: backbone used to embed the samples (see `embed_crops`).
+    font_dirs: Extra directories with font files (e.g. downloaded Google Fonts), besides the system fonts.
+
+    Returns: number of fonts in the index.
+    """
+    font_paths = set(fm.findSystemFonts(fontpaths=None, fontext="ttf")) | set(fm.findSystemFonts(fontpaths=None, fontext="otf"))
+    for font_dir in font_dirs or []:
+        font_paths.update(fm.findSystemFonts(fontpaths=font_dir, fontext="ttf"))
+        font_paths.update(fm.findSystemFonts(fontpaths=font_dir, fontext="otf"))
+
+    names = []
+    name_ids = {}
+    labels = []
+    embeddings = []
+    for font_path in sorted(font_paths):
+        family, samples = render_font_samples(font_path)
+        if not samples:
+            continue
+        if family not in name_ids:
+            name_ids[family] = len(names)
+            names.append(family)
+        embeddings.append(embed_crops(samples, model))
+        labels.extend([name_ids[family]] * len(samples))
+
+    if not embeddings:
+        raise RuntimeError("No usable font files were found to build the font index.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, "embeddings.npy"), np.concatenate(embeddings).astype(np.float16))
+    np.save(os.path.join(output_dir, "labels.npy"), np.asarray(labels, dtype=np.int32))
+    with open(os.path.join(output_dir, "fonts.json"), "w") as f:
+        json.dump(names, f)
+    return len(names)
+
+
+@functools.lru_cache(maxsize=4)
+def load_font_index(index_dir=FONT_INDEX_DIR):
+    """
+    Loads a font index, memory-mapping the embedding matrix.
+
+    index_dir: Directory written by `build_font_index`.
+
+    Returns: (embedding matrix, labels, font names).
+    """
+    embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(index_dir, "labels.npy"))
+    with open(os.path.join(index_dir, "fonts.json")) as f:
+        names = json.load(f)
+    return embeddings, labels, names
+
+
+def require_font_index(index_dir=FONT_INDEX_DIR):
+    """
+    Loads the font index, failing with an explicit error if it has not been built.
+
+    index_dir: Directory written by `build_font_index`.
+
+    Returns: (embedding matrix, labels, font names).
+    """
+    try:
+        return load_font_index(index_dir)
+    except FileNotFoundError:
+        raise RuntimeError(f"Font index not found in '{index_dir}', build it with `python -m app.utils.font_index`.")
+
+
+def identify_fonts(crops, model, index):
+    """
+    Identifies the font of each text crop by nearest-neighbour search in the font index.
+
+    crops: list of PIL images of text crops.
+    model: backbone used to embed the crops (the same used to build the index).
+    index: (embedding matrix, labels, font names), as returned by `load_font_index`.
+
+    Returns: set of identified font names.
+    """
+    embeddings, labels, names = index
+    queries = embed_crops(crops, model)
+    top_k = min(TOP_K, len(labels))
+
+    # Running top-k over chunks of the reference matrix: one batched matrix multiply per chunk.
+    best_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), top_k), dtype=np.int64)
+    for start in range(0, len(labels), SEARCH_CHUNK_ROWS):
+        chunk = np.asarray(embeddings[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))], axis=1)
+        keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+
+    detected_fonts = set()
+    for crop_scores, crop_rows in zip(best_scores, best_rows):
+        if crop_scores.max() < MIN_SIMILARITY:
+            continue
+        # Similarity-weighted vote of the nearest samples.
+        votes = {}
+        for score, row in zip(crop_scores, crop_rows):
+            votes[labels[row]] = votes.get(labels[row], 0) + score
+        detected_fonts.add(names[max(votes, key=votes.get)])
+    return detected_fonts
+
+
+if __name__ == "__main__":
+    from app.utils.fonts import load_font_model
+
+    parser = argparse.ArgumentParser(description="Build the glyph-embedding font index.")
+    parser.add_argument("-o", "--output", default=FONT_INDEX_DIR, help="Directory where the index is written.")
+    parser.add_argument("--fonts-dir", action="append", default=[], help="Extra directory with font files (repeatable).")
+    args = parser.parse_args()
+
+    num_fonts = build_font_index(args.output, load_font_model(), args.fonts_dir)
+    print(f"--- Font index with {num_fonts} fonts written to {args.output} ---")
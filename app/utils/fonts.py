@@ -1,6 +1,5 @@
 import fitz  # PyMuPDF
 from PIL import Image
-from torchvision import transforms
 import torch
 import torchvision.models as models
 import easyocr
@@ -8,7 +7,33 @@ import requests
 import matplotlib.font_manager as fm
 from os.path import basename, splitext
 import numpy as np
+import bisect
+import functools
+import hashlib
 import os
+import re
+from app.utils import font_index, scheduler, rasters, dedup
+
+# Minimum EasyOCR confidence for a text box to be used for font identification.
+MIN_OCR_CONFIDENCE = 0.3
+
+# Resolution of the page renders used to detect text boxes, and of the text crops sent to the recognizer.
+OCR_DETECT_DPI = 100
+OCR_DPI = 150
+
+# Height of the canvases the text crops are stacked on for batched recognition, and the gap between crops.
+OCR_CANVAS_MAX_HEIGHT = 4096
+OCR_CROP_PADDING = 16
+
+# Style words dropped from the end of font names when comparing families.
+FONT_STYLE_SUFFIX = re.compile(
+    r"(regular|bold|italic|oblique|book|light|thin|medium|semibold|demibold|extrabold|ultrabold|heavy|black|"
+    r"extralight|ultralight|condensed|semicondensed|extended|narrow|mt|ps)$"
+)
+
+# Texts read from brand kit pages, keyed by page content hash (oldest entries are dropped first).
+PAGE_TEXT_CACHE_SIZE = 1024
+_page_text_cache = {}
 
 
 
@@ -63,31 +88,47 @@ def build_known_fonts(api_key):
 
 
 
-def analyze_slide_fonts(slide_path, model, api_key):
+@functools.lru_cache(maxsize=1)
+def get_ocr_reader():
     """
-    Analyze fonts used in the slide image using a vision transformer (ViT) model.
+    Loads the EasyOCR reader once per process.
 
-    slide_path: path to image to be assessed. 
-    model: llm model to be used to assess. 
+    Returns: easyocr.Reader for English text.
+    """
+    return easyocr.Reader(['en'])
+
+
+def analyze_slide_fonts(slide, model, api_key):
+    """
+    Identify fonts used in the slide image by matching the text crops found by OCR against the glyph-embedding font index.
+
+    slide: path to image to be assessed, or the PIL image itself. 
+    model: vision backbone used to embed the text crops (see `load_font_model`). 
     api_key: apy key to extract font names from Google Fonts API. 
     
     Returns: set of predicted font names.
     """
+    # Without the index no font can be identified: the check fails instead of reporting a made-up font
+    index = font_index.require_font_index(font_index.FONT_INDEX_DIR)
+
     try:
-        image = Image.open(slide_path).convert("RGB")
-        preprocess = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-        ])
-        input_tensor = preprocess(image).unsqueeze(0)
-        outputs = model(input_tensor)
-        _, predicted = torch.max(outputs, 1)
-        known_fonts = build_known_fonts(api_key)
-        font_mapping = {i: font for i, font in enumerate(known_fonts)}
-        # Fallback for unmapped predictions
-        font_name = font_mapping.get(predicted.item(), f"Unknown Font (Class {predicted.item()})")
-        return {font_name}
+        image = slide if isinstance(slide, Image.Image) else Image.open(slide).convert("RGB")
+        with scheduler.model_slot():
+            ocr_results = get_ocr_reader().readtext(np.asarray(image))
+
+        # Crop every confidently read line of text
+        crops = []
+        for bbox, text, confidence in ocr_results:  # EasyOCR returns [bbox, text, confidence]
+            if confidence < MIN_OCR_CONFIDENCE or len(text.strip()) < 3:
+                continue
+            xs = [point[0] for point in bbox]
+            ys = [point[1] for point in bbox]
+            crops.append(image.crop((int(min(xs)), int(min(ys)), int(max(xs)) + 1, int(max(ys)) + 1)))
+
+        if not crops:
+            return set()
+        with scheduler.model_slot():
+            return font_index.identify_fonts(crops, model, index)
     except FileNotFoundError:
         return {"Error: Slide image not found"}
     except RuntimeError as runtime_err:
@@ -99,39 +140,199 @@ def analyze_slide_fonts(slide_path, model, api_key):
 
     
 
-def extract_written_fonts_from_image(image, api_key):
+def match_font_names(texts, known_fonts):
     """
-    Extract font names written explicitly in a slide image using EasyOCR.
+    Finds the known font names mentioned in a list of texts.
 
-    image: image to be assessed.
-    api_key: apy key to extract font names from Google Fonts API.
+    texts: list of strings (OCR results or PDF text).
+    known_fonts: set of font names, as returned by `build_known_fonts`.
 
-    Returns: set of font names if detected.
+    Returns: set of font names mentioned.
     """
-    try: 
-        reader = easyocr.Reader(['en'])
-        # Convert PIL image to NumPy array
-        image_np = np.array(image)
+    detected_fonts = set()
+    for text in texts:
+        text_lower = text.lower()
+        for font in known_fonts:
+            if font.lower() in text_lower:
+                detected_fonts.add(font)
+    return detected_fonts
 
-        # Extract text using EasyOCR
-        ocr_results = reader.readtext(image_np)
 
-        # Known font names or keywords to look for
-        known_fonts = build_known_fonts(api_key)
-        detected_fonts = set()
-        for _, text, _ in ocr_results:  # EasyOCR returns [bbox, text, confidence]
-            for font in known_fonts:
-                if font.lower() in text.lower():
-                    detected_fonts.add(font)
+def page_content_hash(doc, page):
+    """
+    Hash of what is drawn on a PDF page: its content stream, the Form XObjects it draws (at any depth, as pages
+    imported with `show_pdf_page` or by many exporters only hold a reference to one), the raw data of its images
+    and the fonts it uses.
+
+    doc: fitz document.
+    page: fitz page of the document.
+
+    Returns: sha1 hex digest.
+    """
+    digest = hashlib.sha1(page.read_contents())
+    for xobject in page.get_xobjects():
+        digest.update(doc.xref_stream_raw(xobject[0]) or b"")
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    for xref, _, font_type, base_font, _, encoding, _ in page.get_fonts(full=True):
+        # The same character codes map to other glyphs and text with another font program or encoding
+        digest.update(f"{font_type}/{base_font}/{encoding}".encode())
+        digest.update(hashlib.sha1(doc.extract_font(xref)[3] or b"").digest())
+    return digest.hexdigest()
+
+
+def find_text_regions(page):
+    """
+    Finds the regions of a page that can hold font names, and the text of those the PDF text layer already reads.
+
+    Text lines come from the text layer; images (and pages without any text layer) are searched for text lines
+    with the EasyOCR detector on a low resolution render.
+
+    page: fitz page.
+
+    Returns: (list of texts read from the text layer, list of fitz.Rect text lines that need OCR).
+    """
+    texts = []
+    regions = []
+    text_flags = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+    with rasters.fitz_lock:
+        blocks = page.get_text("dict", flags=text_flags)["blocks"]
+        image_info = page.get_image_info()
+    for block in blocks:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"])
+            if re.search(r"[A-Za-z]{3}", text):
+                texts.append(text)
+            else:
+                # Text drawn with glyphs that have no unicode mapping (outlined or symbol fonts)
+                regions.append(fitz.Rect(line["bbox"]))
+
+    # Images may contain rasterised text
+    detect_areas = [fitz.Rect(image["bbox"]) & page.rect for image in image_info]
+    if not texts and not regions and not detect_areas:
+        detect_areas = [page.rect]
+
+    scale = 72 / OCR_DETECT_DPI
+    for area in detect_areas:
+        if area.is_empty:
+            continue
+        raster = rasters.render_page(page, OCR_DETECT_DPI, "RGB", clip=area)
+        with scheduler.model_slot():
+            horizontal_list, free_list = get_ocr_reader().detect(raster.array)
+        boxes = [(x_min, y_min, x_max, y_max) for x_min, x_max, y_min, y_max in horizontal_list[0]]
+        for points in free_list[0]:
+            xs = [point[0] for point in points]
+            ys = [point[1] for point in points]
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+        for x_min, y_min, x_max, y_max in boxes:
+            regions.append(fitz.Rect(area.x0 + x_min * scale, area.y0 + y_min * scale, area.x0 + x_max * scale, area.y0 + y_max * scale))
+
+    return texts, [region & page.rect for region in regions if not (region & page.rect).is_empty]
+
+
+def recognize_crops(crops):
+    """
+    Reads many grayscale text crops with a few batched EasyOCR recognizer calls.
+
+    The crops are stacked on tall canvases and passed as boxes, so one recognizer call reads the crops of every page
+    instead of running detection and recognition page by page. EasyOCR only batches the boxes of a call on GPU: on
+    CPU it reads them one at a time (which it finds faster there), so the saving is the per-page overhead only.
+
+    crops: list of uint8 grayscale NumPy arrays.
+
+    Returns: list with the text read in each crop.
+    """
+    texts = [""] * len(crops)
+    reader = get_ocr_reader()
+    start = 0
+    while start < len(crops):
+        # Fill one canvas with as many crops as fit
+        end, height = start, 0
+        while end < len(crops) and (end == start or height + crops[end].shape[0] + OCR_CROP_PADDING <= OCR_CANVAS_MAX_HEIGHT):
+            height += crops[end].shape[0] + OCR_CROP_PADDING
+            end += 1
+        width = max(crop.shape[1] for crop in crops[start:end])
+        canvas = np.full((height, width), 255, dtype=np.uint8)
+
+        boxes, tops = [], []
+        y = 0
+        for crop in crops[start:end]:
+            canvas[y:y + crop.shape[0], :crop.shape[1]] = crop
+            boxes.append([0, crop.shape[1], y, y + crop.shape[0]])
+            tops.append(y)
+            y += crop.shape[0] + OCR_CROP_PADDING
+
+        with scheduler.model_slot():
+            ocr_results = reader.recognize(canvas, horizontal_list=boxes, free_list=[], batch_size=len(boxes))
+        for bbox, text, _ in ocr_results:
+            # Map each result back to its crop from its vertical position
+            index = bisect.bisect_right(tops, min(point[1] for point in bbox)) - 1
+            texts[start + index] = f"{texts[start + index]} {text}".strip()
+        start = end
+    return texts
+
+
+def read_pdf_page_texts(pdf_path):
+    """
+    Reads the text of every page of a PDF: from the text layer where possible, with batched OCR of the remaining
+    text regions only. Results are memoized per page content.
+
+    pdf_path: path to the pdf file.
+
+    Returns: list with the texts of each page.
+    """
+    with rasters.fitz_lock:
+        doc = fitz.open(pdf_path)
+        num_pages = len(doc)
+    try:
+        page_texts = []
+        pending = []  # (page index, region crop)
+        page_hashes = []
+        first_pages = {}  # page hash -> first page with that content in this document
+        for page_number in range(num_pages):
+            with rasters.fitz_lock:
+                page = doc[page_number]
+                page_hash = page_content_hash(doc, page)
+            page_hashes.append(page_hash)
+            if page_hash in _page_text_cache:
+                page_texts.append(list(_page_text_cache[page_hash]))
+                continue
+            if page_hash in first_pages:
+                # Repeated page, filled in once its first occurrence has been read
+                page_texts.append(None)
+                continue
+            first_pages[page_hash] = page_number
+
+            texts, regions = find_text_regions(page)
+            page_texts.append(texts)
+            for region in regions:
+                # Only the region is rendered, at a resolution good enough for the recognizer
+                pending.append((page_number, rasters.render_page(page, OCR_DPI, "L", clip=region).array))
+
+        if pending:
+            for (page_number, _), text in zip(pending, recognize_crops([crop for _, crop in pending])):
+                if text:
+                    page_texts[page_number].append(text)
+
+        for page_number, page_hash in enumerate(page_hashes):
+            if page_texts[page_number] is None:
+                page_texts[page_number] = list(page_texts[first_pages[page_hash]])
+
+        for page_hash, texts in zip(page_hashes, page_texts):
+            if page_hash not in _page_text_cache:
+                if len(_page_text_cache) >= PAGE_TEXT_CACHE_SIZE:
+                    _page_text_cache.pop(next(iter(_page_text_cache)), None)
+                _page_text_cache[page_hash] = tuple(texts)
+        return page_texts
+    finally:
+        with rasters.fitz_lock:
+            doc.close()
 
-        return detected_fonts
-    except Exception as e:
-        return {f"Unexpected error when extracting font names written explicitly in a slide image using EasyOCR.: {e}"}
-    
 
 def analyze_pdf_fonts(pdf_path, model, api_key):
     """
-    Analyze fonts used in a PDF file by converting each page to an image and using the `analyze_slide_fonts` function for font detection.
+    Analyze fonts used in a PDF file: font names written in the pages are read first, and pages without any
+    are converted to an image and analysed with the `analyze_slide_fonts` function.
 
     pdf_path: path to brand kit pdf. 
     model: llm model to be used to assess. 
@@ -141,24 +342,26 @@ def analyze_pdf_fonts(pdf_path, model, api_key):
     """
     try:
         detected_fonts = set()
-        doc = fitz.open(pdf_path)
-
-        for page_number in range(len(doc)):
-            page = doc[page_number]
-            pix = page.get_pixmap()  # Render page as an image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            written_fonts = extract_written_fonts_from_image(img, api_key)
+        known_fonts = build_known_fonts(api_key)
+        page_texts = read_pdf_page_texts(pdf_path)
+        with rasters.fitz_lock:
+            doc = fitz.open(pdf_path)
+            num_pages = len(doc)
+        pdf_key = dedup.file_digest(pdf_path)
+
+        for page_number in range(num_pages):
+            written_fonts = match_font_names(page_texts[page_number], known_fonts)
             detected_fonts.update(written_fonts)
 
             if not written_fonts:
-                # Save the image temporarily in memory (or use a temporary file)
-                slide_path = f"temp_page_{page_number}.png"
-                img.save(slide_path)
+                # Render the page as an image (or reuse it from the page store), without temporary files
+                img = rasters.page_store.get(doc, pdf_key, page_number, mode="RGB").to_image()
 
                 # Use the `analyze_slide_fonts` function to detect fonts in the image
-                fonts_in_slide = analyze_slide_fonts(slide_path, model, api_key)
+                fonts_in_slide = analyze_slide_fonts(img, model, api_key)
                 detected_fonts.update(fonts_in_slide)
+        with rasters.fitz_lock:
+            doc.close()
         return detected_fonts
     
     except FileNotFoundError:
@@ -169,6 +372,24 @@ def analyze_pdf_fonts(pdf_path, model, api_key):
         print(f"Unexpected error during PDF font analysis: {e}")
     
 
+def normalize_font_name(name):
+    """
+    Reduces a font name to its family, so names from font files ("DejaVuSans-Bold"), the font index
+    ("DejaVu Sans") and the brand kit text ("dejavu sans") compare equal.
+
+    name: font name.
+
+    Returns: casefolded family name without spaces, hyphens or style suffixes.
+    """
+    family = name.split("-")[0] if "-" in name.strip("-") else name
+    family = re.sub(r"[\s_\-]+", "", family.casefold())
+    while True:
+        stripped = FONT_STYLE_SUFFIX.sub("", family)
+        if stripped == family or not stripped:
+            return family
+        family = stripped
+
+
 def compare_fonts(pdf_fonts, slide_fonts):
     """
     Compare fonts from the PDF and slide image to be assessed.
@@ -178,31 +399,46 @@ def compare_fonts(pdf_fonts, slide_fonts):
 
     Returns: (1, explanation) if fonts match, otherwise (0, explanation).
     """
-    if slide_fonts.issubset(pdf_fonts):
+    pdf_families = {normalize_font_name(font) for font in pdf_fonts}
+    missing_fonts = {font for font in slide_fonts if normalize_font_name(font) not in pdf_families}
+    if not missing_fonts:
         return 1, "All fonts used in the slide are present in the brandkit PDF."
 
     else:
-        missing_fonts = slide_fonts - pdf_fonts
         print("pdf_fonts",pdf_fonts)
         print("slide_fonts", slide_fonts)
         return 0, f"Incorrect fonts detected: {', '.join(missing_fonts)}."
 
 
-def verify_fonts(pdf_path, slide_path, api_key):
+@functools.lru_cache(maxsize=1)
+def load_font_model():
+    """
+    Loads the pre-trained vision backbone used to embed text crops for font identification, once per process.
+
+    Returns: ResNet-18 without its ImageNet classifier, in evaluation mode.
+    """
+    model = models.resnet18(pretrained=True)
+    model.fc = torch.nn.Identity()
+    model.eval()
+    return model
+
+
+def verify_fonts(pdf_path, slide_path, api_key, pdf_fonts=None):
     """
     Determines if the the fonts used in the image to be assessed are correct.
     
     pdf_path: Path to the pdf file.
-    slide_path:  Path to the slide image to be assessed.
+    slide_path:  Path to the slide image to be assessed, or the PIL image itself.
     api_key: apy key to extract font names from Google Fonts API.
+    pdf_fonts: Fonts already extracted from the brand kit, if available (skips the pdf analysis).
 
     Returns: 1 if it uses the proper colors, 0 if not. And a text explaining. 
     """
     # Load a pre-trained vision-based model
-    model = models.resnet18(pretrained=True)
-    model.eval()
+    model = load_font_model()
 
-    pdf_fonts = analyze_pdf_fonts(pdf_path, model, api_key)
+    if pdf_fonts is None:
+        pdf_fonts = analyze_pdf_fonts(pdf_path, model, api_key)
     slide_fonts = analyze_slide_fonts(slide_path, model, api_key)
 
     result, explanation = compare_fonts(pdf_fonts, slide_fonts)
@@ -0,0 +1,152 @@
+import fitz  # PyMuPDF
+import math
+from collections import Counter
+import re
+from app.utils import dedup, rasters
+
+# Keywords describing what each check looks for in the brand kit.
+CHECK_QUERIES = {
+    "logo_position": "logo position placement safe zone clear space clearspace margin padding size minimum "
+                     "scale width height corner top bottom left right center align",
+}
+
+# Default number of tokens the guidelines may take in a prompt.
+DEFAULT_TOKEN_BUDGET = 256
+
+# Blocks with at most this many words and no final period are treated as headings of the next block.
+MAX_HEADING_WORDS = 8
+
+# BM25 parameters.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens of a text.
+    """
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def split_sections(pdf_path):
+    """
+    Splits a brand kit into sections: text blocks of each page, with short heading blocks joined to the block that follows.
+
+    pdf_path: Path to the pdf file.
+
+    Returns: list of section texts, in document order.
+    """
+    sections = []
+    with rasters.fitz_lock:
+        doc = fitz.open(pdf_path)
+        try:
+            for page in doc:
+                heading = ""
+                for block in page.get_text("blocks", sort=True):
+                    text = " ".join(block[4].split())
+                    if block[6] != 0 or not text:  # Skip image blocks
+                        continue
+                    if len(text.split()) <= MAX_HEADING_WORDS and not text.endswith("."):
+                        heading = f"{heading} {text}".strip()
+                        continue
+                    sections.append(f"{heading}: {text}" if heading else text)
+                    heading = ""
+                if heading:
+                    sections.append(heading)
+        finally:
+            doc.close()
+    return sections
+
+
+class BM25:
+    """
+    Okapi BM25 index over a list of sections.
+    """
+
+    def __init__(self, sections):
+        self.documents = [Counter(tokenize(section)) for section in sections]
+        self.lengths = [sum(doc.values()) for doc in self.documents]
+        self.average_length = sum(self.lengths) / max(1, len(self.documents))
+        document_frequency = {}
+        for doc in self.documents:
+            for term in doc:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        num_documents = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (num_documents - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query):
+        """
+        Relevance of every section to a query.
+
+        Returns: list of scores, one per section.
+        """
+        terms = set(tokenize(query))
+        scores = []
+        for doc, length in zip(self.documents, self.lengths):
+            score = 0.0
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * length / max(self.average_length, 1e-8))
+            for term in terms:
+                frequency = doc[term]
+                if frequency:
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+            scores.append(score)
+        return scores
+
+
+def count_words(text):
+    """
+    Rough token count when no tokenizer is given (sub-word tokenizers use about 1.3 tokens per word).
+    """
+    return math.ceil(len(text.split()) * 1.3)
+
+
+def select_sections(sections, query, token_budget=DEFAULT_TOKEN_BUDGET, count_tokens=count_words):
+    """
+    Picks the sections most relevant to a query that fit in a token budget.
+
+    sections: list of section texts.
+    query: keywords of the check.
+    token_budget: Maximum number of tokens of the selected sections.
+    count_tokens: function returning the number of tokens of a text.
+
+    Returns: selected sections joined in document order.
+    """
+    scores = BM25(sections).scores(query)
+    ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i])
+
+    selected = []
+    used_tokens = 0
+    for i in ranked:
+        tokens = count_tokens(sections[i])
+        if used_tokens + tokens > token_budget:
+            continue
+        selected.append(i)
+        used_tokens += tokens
+    return "\n".join(sections[i] for i in sorted(selected))
+
+
+# Guidelines already extracted, keyed by brand kit content and check (oldest entries are dropped first).
+GUIDELINES_CACHE_SIZE = 64
+_guidelines_cache = {}
+
+
+def extract_guidelines(pdf_path, check, token_budget=DEFAULT_TOKEN_BUDGET, count_tokens=count_words):
+    """
+    Extracts the brand kit guidelines relevant to a check, within a token budget. Cached per brand kit content.
+
+    pdf_path: Path to the pdf file.
+    check: Name of the check (a key of CHECK_QUERIES).
+    token_budget: Maximum number of tokens of the guidelines.
+    count_tokens: function returning the number of tokens of a text.
+
+    Returns: guidelines text.
+    """
+    key = (dedup.file_digest(pdf_path), check, token_budget, count_tokens)
+    if key not in _guidelines_cache:
+        if len(_guidelines_cache) >= GUIDELINES_CACHE_SIZE:
+            _guidelines_cache.pop(next(iter(_guidelines_cache)), None)
+        _guidelines_cache[key] = select_sections(split_sections(pdf_path), CHECK_QUERIES[check], token_budget, count_tokens)
+    return _guidelines_cache[key]
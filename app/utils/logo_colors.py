@@ -6,8 +6,12 @@ import torch
 import re
 import matplotlib
 import os
+from app.utils import scheduler, rasters
 
 try:
+  # The load test replaces the model-based checks with stand-ins and sets this before importing the module
+  if os.getenv("BRAND_CHECK_SKIP_MODELS") == "1":
+    raise RuntimeError("model loading is disabled by BRAND_CHECK_SKIP_MODELS")
   # Load model and processor
   processor = Blip2Processor.from_pretrained("Salesforce/blip2-flan-t5-xl")
   model = Blip2ForConditionalGeneration.from_pretrained(
@@ -32,13 +36,14 @@ def extract_logo_colors_from_pdf(pdf_path):
     Returns: list of detected colors in hex format.
     """
     try:
-      doc = fitz.open(pdf_path)
       extracted_colors = set()
       hex_color_pattern = r'#(?:[0-9a-fA-F]{3}){1,2}\b'
+      with rasters.fitz_lock:
+        doc = fitz.open(pdf_path)
+        page_texts = [doc[page_number].get_text() for page_number in range(len(doc))]
+        doc.close()
 
-      for page_number in range(len(doc)):
-          page = doc[page_number]
-          page_text = page.get_text()
+      for page_text in page_texts:
           if "primary colors" in page_text.lower():
             # Find all hex color codes in the page text
             found_colors = re.findall(hex_color_pattern, page_text)
@@ -58,16 +63,17 @@ def extract_logo_colors_from_pdf(pdf_path):
 
 
 
-def check_logo_colors(image_path, pdf_path):
+def check_logo_colors(image_path, pdf_path, brandkit_colors=None):
     """
     Determines if the logo uses the correct colors.
     
     pdf_path: Path to the pdf file.
-    image_path: Path to the slide image to be assessed.
+    image_path: Path to the slide image to be assessed, or the PIL image itself.
+    brandkit_colors: Logo colors already extracted from the brand kit, if available (skips the pdf analysis).
 
     Returns: 1 if it uses the proper colors, 0 if not. And a text explaining. 
     """
-    if not os.path.exists(image_path):
+    if not isinstance(image_path, Image.Image) and not os.path.exists(image_path):
       error_message = f"Error: Logo image file not found at '{image_path}'"
       print(error_message)
       return []
@@ -78,16 +84,18 @@ def check_logo_colors(image_path, pdf_path):
       return []
     try:
       # Load image
-      image = Image.open(image_path).convert("RGB")
+      image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path).convert("RGB")
       
       # Extract instruction text from PDF
-      brandkit_colors = extract_logo_colors_from_pdf(pdf_path)
+      if brandkit_colors is None:
+        brandkit_colors = extract_logo_colors_from_pdf(pdf_path)
       # Compose prompt
       prompt = "What colors are used in the company logo?"
       
       # Process and generate
       inputs = processor(images=image, text=prompt, return_tensors="pt").to(device, torch.float16)
-      output = model.generate(**inputs, max_new_tokens=100)
+      with scheduler.model_slot():
+        output = model.generate(**inputs, max_new_tokens=100)
       result = processor.tokenizer.decode(output[0], skip_special_tokens=True)
       
       # Get all named colors in matplotlib
@@ -1,10 +1,16 @@
-import fitz  # PyMuPDF
 from PIL import Image
 from transformers import Blip2Processor, Blip2ForConditionalGeneration
 import torch
 import os
+from app.utils import scheduler, guidelines
+
+# Stays None if the model cannot be loaded, so the brand kit can still be analysed without it.
+processor = None
 
 try:
+  # The load test replaces the model-based checks with stand-ins and sets this before importing the module
+  if os.getenv("BRAND_CHECK_SKIP_MODELS") == "1":
+    raise RuntimeError("model loading is disabled by BRAND_CHECK_SKIP_MODELS")
   # Load model and processor
   processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
   model = Blip2ForConditionalGeneration.from_pretrained(
@@ -17,36 +23,37 @@ try:
 except Exception as e:
     print(f"Error initializing the Vision-to-Text model: {e}")
 
+def count_prompt_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the model, or estimates them if the model is not available.
+    """
+    if processor is None:
+        return guidelines.count_words(text)
+    return len(processor.tokenizer.tokenize(text))
+
+
 def extract_brand_kit_text(pdf_path):
     """
-    Extracts text from a pdf using fitz.
+    Extracts the brand kit sections most relevant to logo placement and size, within the prompt token budget.
     
     pdf_path: Path to the pdf file.
 
     Returns: Extracted text as a string.
     """
-    # Open pdf document
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    # Extract text from each page and add it to the final string. 
-    for page in doc:
-      page_text = page.get_text() 
-      if "logo" in page_text.lower():
-          full_text +=  page_text
-
-    return full_text
+    return guidelines.extract_guidelines(pdf_path, "logo_position", guidelines.DEFAULT_TOKEN_BUDGET, count_prompt_tokens)
 
 
-def check_logo_position(image_path, pdf_path):
+def check_logo_position(image_path, pdf_path, instructions=None):
     """
     Determines if the logo is in the right position and if it is properly sized.
     
     pdf_path: Path to the pdf file.
-    image_path: Path to the slide image to be assessed.
+    image_path: Path to the slide image to be assessed, or the PIL image itself.
+    instructions: Logo guidelines already extracted from the brand kit, if available (skips the pdf analysis).
 
     Returns: 1 if it is right, 0 if not. And a text explaining. 
     """
-    if not os.path.exists(image_path):
+    if not isinstance(image_path, Image.Image) and not os.path.exists(image_path):
       error_message = f"Error: Logo image file not found at '{image_path}'"
       print(error_message)
       return []
@@ -57,10 +64,11 @@ def check_logo_position(image_path, pdf_path):
       return []
     try:
       # Load image
-      image = Image.open(image_path).convert("RGB")
+      image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path).convert("RGB")
       
       # Extract instruction text from PDF
-      instructions = extract_brand_kit_text(pdf_path)
+      if instructions is None:
+        instructions = extract_brand_kit_text(pdf_path)
       # Compose prompt
       prompt = f"""
       You are a design reviewer. Given the following slide image, determine if the company logo is positioned correctly and has the proper size according to these instructions:
@@ -74,9 +82,10 @@ def check_logo_position(image_path, pdf_path):
       Use exactly this format.
 
       """
-      # Process and generate
+      # Process and generate (text and image are encoded together, so the image placeholder tokens are added to the prompt)
       inputs = processor(images=image, text=prompt, return_tensors="pt").to(device, torch.float16)
-      output = model.generate(**inputs, max_new_tokens=100)
+      with scheduler.model_slot():
+        output = model.generate(**inputs, max_new_tokens=100)
       result = processor.tokenizer.decode(output[0], skip_special_tokens=True)
       result_lower = result.lower()
 
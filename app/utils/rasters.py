@@ -0,0 +1,139 @@
+import fitz  # PyMuPDF
+from PIL import Image
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from app.utils import dedup
+
+# Maximum memory taken by the rendered pages kept in the page store.
+RASTER_STORE_MAX_BYTES = int(os.getenv("RASTER_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+COLORSPACES = {"RGB": fitz.csRGB, "L": fitz.csGRAY}
+
+# PyMuPDF does not support multithreaded use: documents are opened, read and rendered under this lock only.
+fitz_lock = threading.RLock()
+
+
+class PageRaster:
+    """
+    A rendered page. `array` is a read-only NumPy view of the pixmap samples (no copy), which keeps the pixmap alive.
+
+    pix: fitz.Pixmap without alpha, in RGB or grayscale.
+    """
+
+    def __init__(self, pix):
+        self.pix = pix
+        self.mode = "L" if pix.n == 1 else "RGB"
+        shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+        strides = None
+        if pix.stride != pix.width * pix.n:
+            strides = (pix.stride, 1) if pix.n == 1 else (pix.stride, pix.n, 1)
+        # NumPy reads the pixmap memory directly and keeps this object (and so the pixmap) as the base of the array
+        self.__array_interface__ = {
+            "shape": shape,
+            "typestr": "|u1",
+            "data": (pix.samples_ptr, True),
+            "strides": strides,
+            "version": 3,
+        }
+        self.array = np.asarray(self)
+
+    @property
+    def nbytes(self):
+        return self.pix.stride * self.pix.height
+
+    def to_image(self):
+        """
+        PIL image of the page. Grayscale images share the pixmap memory; RGB ones need one copy, as PIL stores them with 4 bytes per pixel.
+
+        Returns: PIL image.
+        """
+        return Image.fromarray(self.array)
+
+
+def render_page(page, dpi=None, mode="RGB", clip=None):
+    """
+    Renders a page straight to the resolution and colorspace a consumer needs.
+
+    page: fitz page.
+    dpi: Render resolution, None for the default 72 dpi.
+    mode: "RGB" or "L" (grayscale).
+    clip: Optional fitz.Rect, to render only a region of the page.
+
+    Returns: PageRaster.
+    """
+    with fitz_lock:
+        pix = page.get_pixmap(dpi=dpi, colorspace=COLORSPACES[mode], alpha=False, clip=clip)
+    return PageRaster(pix)
+
+
+class PageStore:
+    """
+    Rendered pages kept in memory, least recently used first out, up to a maximum number of bytes.
+
+    Pages are keyed by PDF content, so the same brand kit uploaded again (or read by several checks) is rendered once.
+
+    max_bytes: Maximum memory of the stored rasters.
+    """
+
+    def __init__(self, max_bytes=RASTER_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.rasters = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, doc, pdf_key, page_number, dpi=None, mode="RGB"):
+        """
+        Returns a rendered page, rendering it only if it is not stored yet.
+
+        doc: open fitz document.
+        pdf_key: Identifier of the PDF content, from `dedup.file_digest`.
+        page_number: Page index.
+        dpi: Render resolution, None for the default 72 dpi.
+        mode: "RGB" or "L" (grayscale).
+
+        Returns: PageRaster.
+        """
+        key = (pdf_key, page_number, dpi, mode)
+        with self.lock:
+            raster = self.rasters.get(key)
+            if raster is not None:
+                self.rasters.move_to_end(key)
+                return raster
+
+        with fitz_lock:
+            raster = render_page(doc[page_number], dpi, mode)
+        with self.lock:
+            if key not in self.rasters and raster.nbytes <= self.max_bytes:
+                self.rasters[key] = raster
+                self.used_bytes += raster.nbytes
+                while self.used_bytes > self.max_bytes:
+                    _, evicted = self.rasters.popitem(last=False)
+                    self.used_bytes -= evicted.nbytes
+        return raster
+
+    def iter_pages(self, pdf_path, dpi=None, mode="RGB"):
+        """
+        Renders (or reuses) every page of a PDF.
+
+        pdf_path: Path to the pdf file.
+        dpi: Render resolution, None for the default 72 dpi.
+        mode: "RGB" or "L" (grayscale).
+
+        Returns: generator of (page_number, PageRaster).
+        """
+        pdf_key = dedup.file_digest(pdf_path)
+        with fitz_lock:
+            doc = fitz.open(pdf_path)
+            num_pages = len(doc)
+        try:
+            for page_number in range(num_pages):
+                yield page_number, self.get(doc, pdf_key, page_number, dpi, mode)
+        finally:
+            with fitz_lock:
+                doc.close()
+
+
+# Process-wide page store shared by the checks.
+page_store = PageStore()
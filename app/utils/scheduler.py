@@ -0,0 +1,86 @@
+import cv2
+import torch
+import contextlib
+import os
+import threading
+
+# Cores available to the checks, defaults to all the cores of the machine.
+CPU_CORES = int(os.getenv("BRAND_CHECK_CPU_CORES", "0")) or os.cpu_count() or 1
+
+# Maximum number of heavyweight models (BLIP-2, GPT-2, ResNet, EasyOCR) running at once.
+MAX_CONCURRENT_MODELS = int(os.getenv("BRAND_CHECK_MAX_MODELS", "0")) or max(1, CPU_CORES // 4)
+
+
+class ThreadBudgetScheduler:
+    """
+    Splits the CPU cores between concurrent model inferences so their thread pools do not oversubscribe the machine.
+
+    Each inference runs inside `model_slot()`. At most `max_concurrent_models` slots are held at once (the rest
+    wait in line) and each one gets `cores // max_concurrent_models` torch/OpenCV threads.
+
+    cores: Number of cores this process may use.
+    max_concurrent_models: Maximum number of inferences running at once.
+    """
+
+    def __init__(self, cores=CPU_CORES, max_concurrent_models=MAX_CONCURRENT_MODELS):
+        self.cores = max(1, cores)
+        self.max_concurrent_models = max(1, min(max_concurrent_models, self.cores))
+        self.threads_per_model = max(1, self.cores // self.max_concurrent_models)
+        self.slots = threading.BoundedSemaphore(self.max_concurrent_models)
+        self.local = threading.local()
+
+    def apply_thread_budget(self):
+        """
+        Sets the torch intra-op and OpenCV thread counts of this process to the budget of one slot.
+        """
+        torch.set_num_threads(self.threads_per_model)
+        cv2.setNumThreads(self.threads_per_model)
+
+    @contextlib.contextmanager
+    def model_slot(self):
+        """
+        Waits for a free slot and holds it while a model runs. Nested slots in the same thread reuse the outer one.
+        """
+        depth = getattr(self.local, "depth", 0)
+        if depth == 0:
+            self.slots.acquire()
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            if depth == 0:
+                self.slots.release()
+
+
+_scheduler = ThreadBudgetScheduler()
+_scheduler.apply_thread_budget()
+
+
+def configure(cores=CPU_CORES, max_concurrent_models=MAX_CONCURRENT_MODELS):
+    """
+    Replaces the process-wide scheduler, e.g. in worker processes that only own a share of the cores.
+
+    cores: Number of cores this process may use.
+    max_concurrent_models: Maximum number of inferences running at once in this process.
+
+    Returns: the new scheduler.
+    """
+    global _scheduler
+    _scheduler = ThreadBudgetScheduler(cores, max_concurrent_models)
+    _scheduler.apply_thread_budget()
+    return _scheduler
+
+
+def get_scheduler():
+    """
+    Returns: the process-wide scheduler.
+    """
+    return _scheduler
+
+
+def model_slot():
+    """
+    Holds a slot of the process-wide scheduler while a model runs.
+    """
+    return _scheduler.model_slot()
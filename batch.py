@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from app.models import llms_complex
+from app.utils import scheduler
+
+# Extensions of the creatives picked up when walking a directory.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Brand kit shared by every task of a worker process, set by `init_worker`.
+_worker_state = {}
+
+
+def iter_creatives(source):
+    """
+    Lists the creatives to be assessed from a directory or a manifest file.
+
+    source: Directory walked recursively for images, or a text file with one image path per line.
+
+    Returns: generator of image paths.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, file_name)
+    else:
+        manifest_dir = os.path.dirname(os.path.abspath(source))
+        with open(source) as manifest:
+            for line in manifest:
+                path = line.strip()
+                if path and not path.startswith("#"):
+                    # Relative paths in a manifest are relative to the manifest itself.
+                    yield os.path.join(manifest_dir, path)
+
+
+def load_checkpoint(output_path):
+    """
+    Reads the creatives already assessed in a previous (possibly interrupted) run.
+
+    output_path: Path to the JSONL results file, which doubles as the checkpoint.
+
+    Returns: set of image paths already assessed successfully.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, "rb+") as results:
+        content = results.read()
+        # Drop a partially written last line left by an interrupted run.
+        if content and not content.endswith(b"\n"):
+            content = content[:content.rfind(b"\n") + 1]
+            results.truncate(len(content))
+
+    for line in content.decode("utf-8").splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        # Creatives that failed are retried on the next run.
+        if "error" not in result and "path" in result:
+            done.add(result["path"])
+    return done
+
+
+def init_worker(brand_kit, pdf_path, api_key, cores):
+    """
+    Stores the shared brand kit analysis in a worker process and limits its threads to its share of the cores.
+
+    brand_kit: Brand kit already analysed with `llms_complex.analyze_brand_kit`.
+    pdf_path: Path to the brand kit pdf file.
+    api_key: apy key to extract font names from Google Fonts API.
+    cores: Number of cores of this worker.
+    """
+    # Checks run one after the other inside a worker, so one model at a time gets all its cores.
+    scheduler.configure(cores, 1)
+    _worker_state["brand_kit"] = brand_kit
+    _worker_state["pdf_path"] = pdf_path
+    _worker_state["api_key"] = api_key
+
+
+def assess_creative(image_path):
+    """
+    Assesses one creative against the shared brand kit of the worker.
+
+    image_path: Path to the creative to be assessed.
+
+    Returns: dictionary with the path and either the score and explanations, or the error.
+    """
+    try:
+        score, reasons = llms_complex.assess_slide_compliance(
+            image_path, _worker_state["pdf_path"], _worker_state["api_key"], _worker_state["brand_kit"]
+        )
+        return {"path": image_path, "value": score, "reasoning": reasons}
+    except Exception as e:
+        return {"path": image_path, "error": str(e)}
+
+
+def to_json(value):
+    """
+    Makes results JSON serializable (some checks report their errors as sets).
+    """
+    if isinstance(value, set):
+        return sorted(str(item) for item in value)
+    return str(value)
+
+
+def run_batch(pdf_path, source, output_path, api_key, workers=None):
+    """
+    Assesses all creatives of a directory or manifest, appending results to a JSONL file.
+
+    pdf_path: Path to the brand kit pdf file.
+    source: Directory or manifest with the creatives to be assessed.
+    output_path: Path to the JSONL results file. Creatives already in it are skipped.
+    api_key: apy key to extract font names from Google Fonts API.
+    workers: Number of worker processes, defaults to the number of cores.
+
+    Returns: number of creatives assessed in this run.
+    """
+    workers = workers or os.cpu_count() or 1
+    done = load_checkpoint(output_path)
+    pending = (path for path in iter_creatives(source) if path not in done)
+    if done:
+        print(f"Resuming: {len(done)} creatives already assessed.")
+
+    # The brand kit is analysed once and shipped to every worker.
+    brand_kit = llms_complex.analyze_brand_kit(pdf_path, api_key)
+
+    assessed = 0
+    with open(output_path, "a") as results, ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(brand_kit, pdf_path, api_key, max(1, scheduler.CPU_CORES // workers))
+    ) as pool:
+        in_flight = set()
+        while True:
+            # Only a few tasks per worker are queued, so huge archives are never listed in memory at once.
+            for path in pending:
+                in_flight.add(pool.submit(assess_creative, path))
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                break
+
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                results.write(json.dumps(result, default=to_json) + "\n")
+                results.flush()
+                os.fsync(results.fileno())
+                assessed += 1
+                print(f"[{assessed}] {result['path']}: {result.get('value', result.get('error'))}")
+
+    return assessed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assess a directory or manifest of creatives against one brand kit.")
+    parser.add_argument("pdf", help="Path to the brand kit PDF.")
+    parser.add_argument("source", help="Directory with the creatives, or a manifest file with one image path per line.")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL results file, also used to resume interrupted runs.")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes (default: number of cores).")
+    parser.add_argument("--api-key", default=os.getenv("GOOGLE_FONTS_API_KEY", ""), help="Google Fonts API key.")
+    args = parser.parse_args()
+
+    assessed = run_batch(args.pdf, args.source, args.output, args.api_key, args.workers)
+    print(f"--- Assessed {assessed} creatives, results in {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Extensions of the slides picked up when the corpus is a directory.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def load_corpus(source, kit_path=None):
+    """
+    Lists the (slide, brand kit) pairs replayed during the load test.
+
+    source: Directory of slides (all assessed against kit_path), or a manifest file with one "slide,kit" pair per line.
+    kit_path: Brand kit used for every slide of a directory.
+
+    Returns: list of (slide path, kit path).
+    """
+    if os.path.isdir(source):
+        if kit_path is None:
+            raise ValueError("A brand kit (--kit) is required when the corpus is a directory of slides.")
+        slides = sorted(
+            os.path.join(source, file_name) for file_name in os.listdir(source)
+            if file_name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        return [(slide, kit_path) for slide in slides]
+
+    pairs = []
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            slide, kit = (part.strip() for part in line.split(",", 1))
+            pairs.append((os.path.join(manifest_dir, slide), os.path.join(manifest_dir, kit)))
+    return pairs
+
+
+def read_rss_mb(pid=None):
+    """
+    Resident memory of a process, from /proc (Linux only).
+
+    pid: Process id, defaults to this process.
+
+    Returns: RSS in MB, or None if it cannot be read.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def install_stand_in_models(latency):
+    """
+    Replaces the model-based checks with fast stand-ins, so the load test runs on a CPU-only machine.
+
+    The stand-ins keep the real file handling and color extraction, and hold a scheduler slot for `latency`
+    seconds in place of each model inference, so queueing behaves as with the real models.
+
+    latency: Seconds each stand-in model inference takes.
+    """
+    # Do not load the BLIP-2 models when the logo modules are imported, nor download the others: they are replaced below.
+    os.environ["BRAND_CHECK_SKIP_MODELS"] = "1"
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    from PIL import Image
+    from app.utils import fonts, colors, logo_position, logo_colors, scheduler
+
+    def run_model():
+        with scheduler.model_slot():
+            time.sleep(latency)
+
+    def verify_fonts(pdf_path, slide_path, api_key, pdf_fonts=None):
+        Image.open(slide_path).convert("RGB")
+        run_model()
+        return 1, "All fonts used in the slide are present in the brandkit PDF."
+
+    def check_logo_position(image_path, pdf_path, instructions=None):
+        run_model()
+        return 1, "Logo is correctly positioned and sized."
+
+    def check_logo_colors(image_path, pdf_path, brandkit_colors=None):
+        run_model()
+        return 1, "The logo uses only the brand colors."
+
+    def analyze_colors(pdf_path, slide_path, pdf_colors=None):
+        if pdf_colors is None:
+            pdf_colors = colors.extract_colors_from_pdf(pdf_path)
+        slide_colors = colors.extract_colors_from_slide(slide_path)
+        run_model()
+        return 1, f"{len(slide_colors)} slide colors checked against {len(pdf_colors)} brand colors."
+
+    fonts.verify_fonts = verify_fonts
+    logo_position.check_logo_position = check_logo_position
+    logo_colors.check_logo_colors = check_logo_colors
+    colors.analyze_colors = analyze_colors
+
+
+def start_local_server():
+    """
+    Starts the FastAPI app with uvicorn on a free localhost port, in a background thread of this process.
+
+    Returns: (base url, uvicorn server, server thread).
+    """
+    import uvicorn
+    import main
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The local server failed to start.")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server, thread
+
+
+def send_request(session, url, slide_path, kit_path, reuse):
+    """
+    Uploads one slide and brand kit.
+
+    Returns: (latency in seconds, True if the request succeeded).
+    """
+    start = time.perf_counter()
+    try:
+        with open(slide_path, "rb") as slide, open(kit_path, "rb") as kit:
+            response = session.post(
+                f"{url}/upload/",
+                files={"image": (os.path.basename(slide_path), slide), "pdf": (os.path.basename(kit_path), kit)},
+                data={"reuse": reuse},
+            )
+        ok = response.status_code == 200 and "error" not in response.json()
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_level(url, corpus, concurrency, num_requests, reuse, server_pid):
+    """
+    Sends a number of requests with a fixed number of concurrent clients.
+
+    url: Base url of the API.
+    corpus: list of (slide path, kit path), replayed round-robin.
+    concurrency: Number of concurrent clients.
+    num_requests: Total number of requests of this level.
+    reuse: Value of the 'reuse' form field.
+    server_pid: Process whose memory is measured (None if it is not known).
+
+    Returns: dictionary with throughput, latency percentiles, error rate and memory of the level.
+    """
+    sessions = threading.local()
+    peak_rss = [read_rss_mb(server_pid) if server_pid else None]
+    done = threading.Event()
+
+    def sample_rss():
+        while server_pid and not done.wait(0.1):
+            rss = read_rss_mb(server_pid)
+            if rss is not None:
+                peak_rss[0] = max(peak_rss[0] or 0, rss)
+
+    def client(i):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        slide_path, kit_path = corpus[i % len(corpus)]
+        return send_request(sessions.session, url, slide_path, kit_path, reuse)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(num_requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    latencies = [latency for latency, ok in results if ok]
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "throughput_rps": num_requests / elapsed,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "error_rate": errors / num_requests,
+        "peak_rss_mb": peak_rss[0],
+        "rss_after_mb": read_rss_mb(server_pid) if server_pid else None,
+    }
+
+
+def format_row(level):
+    """
+    One line of the results table.
+    """
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else "-"
+
+    return (
+        f"{level['concurrency']:>11} {level['requests']:>8} {fmt(level['throughput_rps'], '>10.2f')} "
+        f"{fmt(level['p50_s'], '>8.3f')} {fmt(level['p95_s'], '>8.3f')} {fmt(level['p99_s'], '>8.3f')} "
+        f"{fmt(level['error_rate'], '>7.1%')} {fmt(level['peak_rss_mb'], '>9.0f')}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /upload/ endpoint at rising concurrency levels.")
+    parser.add_argument("corpus", help="Directory of slides (with --kit), or a manifest with one 'slide,kit' pair per line.")
+    parser.add_argument("--kit", help="Brand kit PDF used for every slide of a directory corpus.")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma separated concurrency levels.")
+    parser.add_argument("--requests-per-client", type=int, default=4, help="Requests sent per concurrent client at each level.")
+    parser.add_argument("--url", help="Base url of a running server. By default the app is started in-process on localhost.")
+    parser.add_argument("--server-pid", type=int, help="Process id of the server given with --url, to measure its memory.")
+    parser.add_argument("--real-models", action="store_true", help="Use the real models instead of the fast stand-ins (in-process server only).")
+    parser.add_argument("--stand-in-latency", type=float, default=0.2, help="Seconds each stand-in model inference takes.")
+    parser.add_argument("--reuse", default="off", choices=["off", "reuse", "partial"], help="Reuse mode sent with each request.")
+    parser.add_argument("-o", "--output", help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.kit)
+    if not corpus:
+        parser.error("The corpus is empty.")
+
+    server = None
+    url = args.url
+    # The memory measured is the one of the server: this process when the app runs in-process
+    server_pid = args.server_pid if url else os.getpid()
+    if url is None:
+        if not args.real_models:
+            install_stand_in_models(args.stand_in_latency)
+        url, server, server_thread = start_local_server()
+
+    print(f"Load testing {url}/upload/ with {len(corpus)} slide/kit pairs")
+    print(f"{'concurrency':>11} {'requests':>8} {'req/s':>10} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>7} {'RSS MB':>9}")
+    levels = []
+    try:
+        for concurrency in (int(level) for level in args.levels.split(",")):
+            level = run_level(url, corpus, concurrency, concurrency * args.requests_per_client, args.reuse, server_pid)
+            levels.append(level)
+            print(format_row(level))
+    finally:
+        if server is not None:
+            server.should_exit = True
+            server_thread.join()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(levels, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
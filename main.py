@@ -1,11 +1,20 @@
 from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from app.models import llms_complex
+from app.utils import decks, dedup
 import shutil
 import os
+import tempfile
 
 app = FastAPI(title="Brand Compliance Checker")
 
+# Api key used to extract font names from Google Fonts API.
+API_KEY = os.getenv("GOOGLE_FONTS_API_KEY", "")
+
+# Previous results, searched by perceptual hash to reuse them for near-identical slides.
+RESULT_INDEX = dedup.ResultIndex(os.getenv("RESULT_INDEX_PATH"))
+
 # Define a function to return a description of the app
 def get_app_description():
     return (
@@ -13,6 +22,8 @@ def get_app_description():
         "This API allows you to assess brand alignment by analyzing an image and a brand kit PDF."
         "Use the '/upload/' endpoint with a POST request to upload an image file, a PDF file, along with your company name."
         "Example usage: POST to '/upload/' with form data including 'image', 'pdf', and 'company_name'."
+        "Set 'reuse' to 'reuse' or 'partial' to reuse the results of a near-identical slide assessed with the same brand kit (within 'max_distance' bits)."
+        "Multi-page decks (PDF or PPTX) can be assessed page by page with the '/upload-deck/' endpoint, using 'deck' and 'pdf'."
     )
 
 
@@ -24,38 +35,82 @@ async def root():
 @app.post("/upload/")
 async def upload_files(
     image: UploadFile = File(...),
-    pdf: UploadFile = File(...)
+    pdf: UploadFile = File(...),
+    reuse: str = Form("off"),
+    max_distance: int = Form(dedup.DEFAULT_MAX_DISTANCE)
 ):
+    request_dir = None
     try:
+        if reuse not in ("off", "reuse", "partial"):
+            return JSONResponse(content={"error": f"Invalid reuse mode: {reuse}"}, status_code=400)
+
         # Notify the user that the process may take a few minutes
         processing_message = "Processing your request. This may take a few minutes..."
-        if not os.path.exists("temp"):
-              os.makedirs("temp")
+        # Each request gets its own folder so concurrent uploads with the same file names do not collide
+        os.makedirs("temp", exist_ok=True)
+        request_dir = tempfile.mkdtemp(dir="temp")
 
         # Save the uploaded image
-        image_path = f"temp/{image.filename}"
+        image_path = os.path.join(request_dir, os.path.basename(image.filename))
         with open(image_path, "wb") as buffer:
             shutil.copyfileobj(image.file, buffer)
         
         # Save the uploaded PDF
-        pdf_path = f"temp/{pdf.filename}"
+        pdf_path = os.path.join(request_dir, "brandkit_" + os.path.basename(pdf.filename))
         with open(pdf_path, "wb") as buffer:
             shutil.copyfileobj(pdf.file, buffer)
         print(processing_message)
 
-        # Call the assessllm function
-        value, reasoning = llms_complex.assessmentllm(image_path, pdf_path, API_KEY, company_name)
-        
-        # Clean up temporary files
-        os.remove(image_path)
-        os.remove(pdf_path)
+        # Assess the slide in a worker thread (reusing the results of a near-identical one if requested),
+        # so the server keeps accepting requests while the models run
+        value, reasoning, reused_distance = await run_in_threadpool(
+            llms_complex.assess_slide_compliance_dedup, image_path, pdf_path, API_KEY, RESULT_INDEX, reuse, max_distance
+        )
         
         # Return the response
-        return JSONResponse(content={"value": value, "reasoning": reasoning})
+        return JSONResponse(content={"value": value, "reasoning": reasoning, "reused_distance": reused_distance})
     
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+    finally:
+        # Clean up temporary files, also when the assessment failed
+        if request_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
+
+
+@app.post("/upload-deck/")
+async def upload_deck(
+    deck: UploadFile = File(...),
+    pdf: UploadFile = File(...)
+):
+    request_dir = None
+    try:
+        if not decks.is_deck(deck.filename):
+            return JSONResponse(content={"error": f"Unsupported deck format: {deck.filename}"}, status_code=400)
 
+        os.makedirs("temp", exist_ok=True)
+        request_dir = tempfile.mkdtemp(dir="temp")
 
+        # Save the uploaded deck
+        deck_path = os.path.join(request_dir, "deck_" + os.path.basename(deck.filename))
+        with open(deck_path, "wb") as buffer:
+            shutil.copyfileobj(deck.file, buffer)
+
+        # Save the uploaded PDF
+        pdf_path = os.path.join(request_dir, "brandkit_" + os.path.basename(pdf.filename))
+        with open(pdf_path, "wb") as buffer:
+            shutil.copyfileobj(pdf.file, buffer)
+
+        # Assess the deck page by page in a worker thread
+        summary = await run_in_threadpool(llms_complex.assessmentllm_deck, deck_path, pdf_path, API_KEY)
+
+        return JSONResponse(content=summary)
+
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
+    finally:
+        # Clean up temporary files, also when the assessment failed
+        if request_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
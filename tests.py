@@ -1,7 +1,28 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from app.utils import fonts, colors, logo_colors, logo_position
-from app.models import complex_llms
+from app.utils import fonts, colors, logo_colors, logo_position, dedup, font_index, scheduler, guidelines, rasters, decks
+import threading
+import time
+import matplotlib
+import torch
+import numpy as np
+from PIL import Image, ImageDraw
+from app.models import llms_complex
+import batch
+import loadtest
+import main
+import asyncio
+import io
+import pathlib
+from fastapi import UploadFile
+import json
+import fitz
+import os
+import tempfile
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from transformers import PreTrainedTokenizerFast, Blip2Processor, BlipImageProcessor
 
 class TestBrandCompliance(unittest.TestCase):
 
@@ -38,18 +59,405 @@ class TestBrandCompliance(unittest.TestCase):
         score, explanation = logo_position.check_logo_position("dummy.png", "dummy.pdf")
         self.assertEqual(score, 1)
 
-    @patch('app.models.complex_llms.fonts.verify_fonts')
-    @patch('app.models.complex_llms.logo_position.check_logo_position')
-    @patch('app.models.complex_llms.logo_colors.check_logo_colors')
-    @patch('app.models.complex_llms.colors.analyze_colors')
+    @patch('app.models.llms_complex.fonts.verify_fonts')
+    @patch('app.models.llms_complex.logo_position.check_logo_position')
+    @patch('app.models.llms_complex.logo_colors.check_logo_colors')
+    @patch('app.models.llms_complex.colors.analyze_colors')
     def test_assessment_pipeline(self, mock_colors, mock_logo_colors, mock_logo_pos, mock_fonts):
         mock_fonts.return_value = (1, "Font OK")
         mock_logo_pos.return_value = (1, "Logo OK")
         mock_logo_colors.return_value = (1, "Colors OK")
         mock_colors.return_value = (1, "Palette OK")
-        score, reasons = complex_llms.assess_slide_compliance("image.png", "kit.pdf", "api")
+        score, reasons = llms_complex.assess_slide_compliance("image.png", "kit.pdf", "api")
         self.assertEqual(score, 4)
         self.assertEqual(len(reasons), 4)
 
+    @patch('app.models.llms_complex.fonts.verify_fonts')
+    @patch('app.models.llms_complex.logo_position.check_logo_position')
+    @patch('app.models.llms_complex.logo_colors.check_logo_colors')
+    @patch('app.models.llms_complex.colors.analyze_colors')
+    def test_assessment_shared_brand_kit(self, mock_colors, mock_logo_colors, mock_logo_pos, mock_fonts):
+        for mock in (mock_colors, mock_logo_colors, mock_logo_pos, mock_fonts):
+            mock.return_value = (1, "OK")
+        brand_kit = {"fonts": {"Inter"}, "colors": ["#ffffff"], "logo_colors": ["#FFD14C"], "logo_guidelines": "Logo top left."}
+        llms_complex.assess_slide_compliance("image.png", "kit.pdf", "api", brand_kit)
+        mock_fonts.assert_called_once_with("kit.pdf", "image.png", "api", {"Inter"})
+        mock_logo_pos.assert_called_once_with("image.png", "kit.pdf", "Logo top left.")
+        mock_logo_colors.assert_called_once_with("image.png", "kit.pdf", ["#FFD14C"])
+        mock_colors.assert_called_once_with("kit.pdf", "image.png", ["#ffffff"])
+
+    @patch('app.models.llms_complex.analyze_brand_kit')
+    @patch('app.models.llms_complex.assess_slide_compliance')
+    def test_deck_pipeline(self, mock_assess, mock_brand_kit):
+        mock_brand_kit.return_value = {}
+        mock_assess.return_value = (3, {"Font style": "ok"})
+        with tempfile.TemporaryDirectory() as tmp:
+            deck_path = os.path.join(tmp, "deck.pdf")
+            doc = fitz.open()
+            for _ in range(5):
+                doc.new_page(width=200, height=100)
+            doc.save(deck_path)
+
+            summary = llms_complex.assessmentllm_deck(deck_path, "kit.pdf", "api", max_in_flight=2)
+        self.assertEqual(summary["num_pages"], 5)
+        self.assertEqual([page["page"] for page in summary["pages"]], [1, 2, 3, 4, 5])
+        self.assertEqual(summary["total_value"], 15)
+        self.assertEqual(summary["max_value"], 20)
+        # Pages are rendered in memory, without temporary files.
+        for call in mock_assess.call_args_list:
+            self.assertIsInstance(call.args[0], Image.Image)
+
+    def test_prefetch_bounds_rendered_pages(self):
+        rendered = []
+
+        def pages():
+            for page_number in range(6):
+                rendered.append(page_number)
+                yield page_number, None
+
+        for page_number, _ in decks.prefetch_pages(pages(), max_in_flight=2):
+            time.sleep(0.05)  # Let the producer render ahead as far as it can
+            # The page being assessed plus the pages rendered ahead of it
+            self.assertLessEqual(len(rendered) - page_number, 2)
+        self.assertEqual(len(rendered), 6)
+
+    @patch('app.utils.decks.subprocess.run')
+    @patch('app.utils.decks.shutil.which')
+    def test_presentation_conversions_use_own_profile(self, mock_which, mock_run):
+        mock_which.return_value = "/usr/bin/soffice"
+        with tempfile.TemporaryDirectory() as tmp:
+            open(os.path.join(tmp, "deck.pdf"), "wb").close()
+            self.assertEqual(decks.convert_presentation_to_pdf("/uploads/deck.pptx", tmp), os.path.join(tmp, "deck.pdf"))
+        profile_arg = mock_run.call_args.args[0][1]
+        self.assertEqual(profile_arg, "-env:UserInstallation=" + pathlib.Path(tmp, "lo_profile").resolve().as_uri())
+
+    @patch('app.models.llms_complex.assessmentllm_deck')
+    def test_failed_requests_remove_their_folder(self, mock_deck):
+        mock_deck.side_effect = RuntimeError("Could not convert")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                response = asyncio.run(main.upload_deck(
+                    deck=UploadFile(io.BytesIO(b"%PDF"), filename="deck.pdf"),
+                    pdf=UploadFile(io.BytesIO(b"%PDF"), filename="kit.pdf"),
+                ))
+                self.assertEqual(response.status_code, 500)
+                self.assertEqual(os.listdir("temp"), [])
+            finally:
+                os.chdir(cwd)
+
+    def test_batch_checkpoint_skips_done_and_partial_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = os.path.join(tmp, "results.jsonl")
+            with open(output_path, "w") as results:
+                results.write(json.dumps({"path": "a.png", "value": 4}) + "\n")
+                results.write('{"path": "b.png", "val')
+            self.assertEqual(batch.load_checkpoint(output_path), {"a.png"})
+            with open(output_path) as results:
+                self.assertEqual(len(results.read().splitlines()), 1)
+
+    def test_batch_manifest_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest_path = os.path.join(tmp, "manifest.txt")
+            with open(manifest_path, "w") as manifest:
+                manifest.write("slides/a.png\n\n# skipped\n/abs/b.jpg\n")
+            self.assertEqual(
+                list(batch.iter_creatives(manifest_path)),
+                [os.path.join(tmp, "slides/a.png"), "/abs/b.jpg"],
+            )
+
+    def test_dedup_finds_near_identical_slides(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            image = Image.new("RGB", (640, 360), "white")
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((40, 40, 300, 160), fill="#85A0FE")
+            draw.text((60, 220), "Quarterly results", fill="black")
+            image.save(os.path.join(tmp, "slide.png"))
+            image.save(os.path.join(tmp, "slide.jpg"), quality=40)
+            Image.new("RGB", (640, 360), "black").save(os.path.join(tmp, "other.png"))
+
+            index = dedup.ResultIndex(os.path.join(tmp, "index.jsonl"))
+            index.add(dedup.slide_hash(os.path.join(tmp, "slide.png")), "kit", {"Font style": [1, "OK"]})
+            reloaded = dedup.ResultIndex(os.path.join(tmp, "index.jsonl"))
+
+            self.assertIsNotNone(reloaded.lookup(dedup.slide_hash(os.path.join(tmp, "slide.jpg")), "kit"))
+            self.assertIsNone(reloaded.lookup(dedup.slide_hash(os.path.join(tmp, "slide.jpg")), "other kit"))
+            self.assertIsNone(reloaded.lookup(dedup.slide_hash(os.path.join(tmp, "other.png")), "kit"))
+
+    @patch('app.models.llms_complex.run_checks')
+    @patch('app.models.llms_complex.dedup.file_digest')
+    @patch('app.models.llms_complex.dedup.slide_hash')
+    def test_dedup_partial_recomputes_only_rechecks(self, mock_hash, mock_digest, mock_run_checks):
+        mock_digest.return_value = "kit"
+        index = dedup.ResultIndex()
+        index.add(0b1111, "kit", {category: [1, "Previous"] for category in llms_complex.CHECKS})
+        mock_hash.return_value = 0b0111
+        mock_run_checks.return_value = {"Font style": (0, "Changed"), "Color palette": (1, "OK")}
+
+        score, reasons, distance = llms_complex.assess_slide_compliance_dedup("image.png", "kit.pdf", "api", index, mode="partial")
+        mock_run_checks.assert_called_once_with("image.png", "kit.pdf", "api", None, llms_complex.NEAR_DUPLICATE_RECHECKS)
+        self.assertEqual((score, distance), (3, 1))
+        self.assertEqual(reasons["Font style"], "Changed")
+        self.assertEqual(reasons["Logo Safe Zone"], "Previous")
+
+    @patch('app.models.llms_complex.run_checks')
+    @patch('app.models.llms_complex.dedup.file_digest')
+    @patch('app.models.llms_complex.dedup.slide_hash')
+    def test_dedup_index_is_bounded(self, mock_hash, mock_digest, mock_run_checks):
+        mock_digest.return_value = "kit"
+        mock_hash.return_value = 0
+        mock_run_checks.return_value = {"Font style": (1, "OK")}
+        index = dedup.ResultIndex(max_records=4, max_brand_kits=2)
+        # Results assessed without reuse are not stored.
+        llms_complex.assess_slide_compliance_dedup("image.png", "kit.pdf", "api", index, mode="off")
+        self.assertIsNone(index.lookup(0, "kit"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = dedup.ResultIndex(os.path.join(tmp, "index.jsonl"), max_records=4, max_brand_kits=2)
+            for key in range(5):
+                index.add(key, "kit", {"Font style": [1, str(key)]})
+            index.add(0, "other kit", {})
+            index.add(0, "third kit", {})
+            self.assertIsNone(index.lookup(0, "kit"))
+            self.assertIsNotNone(index.lookup(0, "other kit"))
+
+            index.add(0, "kit", {})
+            reloaded = dedup.ResultIndex(os.path.join(tmp, "index.jsonl"), max_records=4, max_brand_kits=2)
+            self.assertIsNone(reloaded.lookup(0, "third kit"))
+            self.assertEqual(len(reloaded.brand_kits["kit"][1]), 1)
+
+    def test_font_index_identifies_rendered_font(self):
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 16, 5, stride=2), torch.nn.ReLU(), torch.nn.AdaptiveAvgPool2d((3, 8)), torch.nn.Flatten()
+        ).eval()
+        font_dir = os.path.join(matplotlib.get_data_path(), "fonts", "ttf")
+        with tempfile.TemporaryDirectory() as tmp:
+            font_index.build_font_index(tmp, model, [font_dir])
+            index = font_index.load_font_index(tmp)
+            self.assertEqual(index[0].dtype, "float16")
+
+            family, samples = font_index.render_font_samples(os.path.join(font_dir, "DejaVuSerif-Bold.ttf"))
+            self.assertEqual(font_index.identify_fonts(samples[:1], model, index), {family})
+
+            # Without an index the check fails instead of reporting a font
+            with patch.object(font_index, "FONT_INDEX_DIR", os.path.join(tmp, "missing")):
+                with self.assertRaises(RuntimeError):
+                    fonts.analyze_slide_fonts(Image.new("RGB", (64, 64)), model, "api")
+
+    @patch('app.utils.fonts.models.resnet18')
+    def test_font_model_loaded_once(self, mock_resnet):
+        fonts.load_font_model.cache_clear()
+        try:
+            self.assertIs(fonts.load_font_model(), fonts.load_font_model())
+            mock_resnet.assert_called_once()
+        finally:
+            fonts.load_font_model.cache_clear()
+
+    def test_compare_fonts_matches_families(self):
+        pdf_fonts = {"DejaVuSans-Bold", "Inter", "TimesNewRomanPS-BoldMT"}
+        self.assertEqual(fonts.compare_fonts(pdf_fonts, {"DejaVu Sans", "Times New Roman"})[0], 1)
+        score, explanation = fonts.compare_fonts(pdf_fonts, {"DejaVu Serif"})
+        self.assertEqual(score, 0)
+        self.assertIn("DejaVu Serif", explanation)
+
+    def test_slide_colors_tiled_matches_full_image(self):
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 8, (300, 200, 3), dtype=np.uint8) * 32
+        with tempfile.TemporaryDirectory() as tmp:
+            slide_path = os.path.join(tmp, "slide.png")
+            Image.fromarray(pixels).save(slide_path)
+            expected = {"#{:02x}{:02x}{:02x}".format(*color) for color in np.unique(pixels.reshape(-1, 3), axis=0)}
+            self.assertEqual(set(colors.extract_colors_from_slide(slide_path, strip_rows=37)), expected)
+            self.assertEqual(set(colors.extract_colors_from_slide(slide_path, strip_rows=None)), expected)
+
+        # Colors are listed by frequency, so the prompt shows the dominant ones
+        pixels = np.zeros((100, 100, 3), dtype=np.uint8)
+        pixels[:, :70] = (255, 255, 255)
+        pixels[:, 70:95] = (133, 160, 254)
+        pixels[0, 0] = (1, 2, 3)
+        self.assertEqual(colors.extract_colors_from_slide(Image.fromarray(pixels), strip_rows=7), ["#ffffff", "#85a0fe", "#000000", "#010203"])
+
+    def test_scheduler_limits_concurrent_models(self):
+        budget = scheduler.ThreadBudgetScheduler(cores=8, max_concurrent_models=2)
+        self.assertEqual(budget.threads_per_model, 4)
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def run_model():
+            with budget.model_slot():
+                # Nested slots in the same thread must not deadlock.
+                with budget.model_slot():
+                    with lock:
+                        active[0] += 1
+                        peak[0] = max(peak[0], active[0])
+                    time.sleep(0.02)
+                    with lock:
+                        active[0] -= 1
+
+        threads = [threading.Thread(target=run_model) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_guidelines_ranked_within_budget(self):
+        sections = [
+            "Our Story: We were founded in 1999 to make great products.",
+            "Logo Usage: Place the logo in the top left corner with a clear space margin of 20 px.",
+            "Logo Size: The minimum logo width is 40 px.",
+            "Typography: Headings use Lexend, body text uses Inter.",
+        ]
+        selected = guidelines.select_sections(sections, guidelines.CHECK_QUERIES["logo_position"], token_budget=1000)
+        self.assertEqual(selected, sections[1] + "\n" + sections[2])
+
+        # With a small budget only the most relevant section that fits is kept.
+        selected = guidelines.select_sections(sections, guidelines.CHECK_QUERIES["logo_position"], token_budget=12)
+        self.assertEqual(selected, sections[2])
+
+        # Without the model, tokens are estimated instead of failing the whole brand kit analysis.
+        with patch('app.utils.logo_position.processor', None):
+            self.assertEqual(logo_position.count_prompt_tokens("Logo top left"), guidelines.count_words("Logo top left"))
+
+    def test_logo_position_prompt_has_image_tokens(self):
+        vocab = Tokenizer(WordLevel({"[UNK]": 0, "[PAD]": 1}, unk_token="[UNK]"))
+        vocab.pre_tokenizer = Whitespace()
+        tokenizer = PreTrainedTokenizerFast(tokenizer_object=vocab, unk_token="[UNK]", pad_token="[PAD]")
+        processor = Blip2Processor(image_processor=BlipImageProcessor(), tokenizer=tokenizer, num_query_tokens=4)
+        model = MagicMock()
+        model.config.image_token_id = tokenizer.convert_tokens_to_ids("<image>")
+        processor.tokenizer.decode = MagicMock(return_value="1: Logo is correct.")
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch('app.utils.logo_position.processor', processor), \
+                patch('app.utils.logo_position.model', model, create=True), \
+                patch('app.utils.logo_position.device', "cpu", create=True):
+            pdf_path = os.path.join(tmp, "kit.pdf")
+            doc = fitz.open()
+            doc.new_page()
+            doc.save(pdf_path)
+            score, _ = logo_position.check_logo_position(Image.new("RGB", (64, 64)), pdf_path, "Logo top left.")
+
+        self.assertEqual(score, 1)
+        input_ids = model.generate.call_args.kwargs["input_ids"]
+        # BLIP-2 scatters the image embeddings into these placeholders: without them the slide is ignored
+        self.assertEqual(int((input_ids == model.config.image_token_id).sum()), 4)
+
+    @patch.dict('app.utils.fonts._page_text_cache', clear=True)
+    @patch('app.utils.fonts.get_ocr_reader')
+    def test_pdf_page_texts_batched_and_memoized(self, mock_reader):
+        reader = mock_reader.return_value
+        reader.detect.return_value = ([[[10, 110, 5, 25], [10, 60, 40, 60]]], [[]])
+        reader.recognize.side_effect = lambda canvas, horizontal_list, free_list, batch_size: [
+            ([[box[0], box[2]], [box[1], box[2]], [box[1], box[3]], [box[0], box[3]]], f"Font {i}", 0.9)
+            for i, box in enumerate(horizontal_list)
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "kit.pdf")
+            doc = fitz.open()
+            doc.new_page().insert_text((50, 60), "Typography: Inter and Lexend")
+            doc.new_page()  # No text layer, needs detection
+            doc.new_page().insert_text((50, 60), "1 2 3")  # Text layer without words, needs OCR
+            doc.new_page()  # Same content as the second page
+            doc.save(pdf_path)
+
+            page_texts = fonts.read_pdf_page_texts(pdf_path)
+            self.assertEqual(page_texts[0], ["Typography: Inter and Lexend"])
+            self.assertEqual(page_texts[1], ["Font 0", "Font 1"])
+            self.assertEqual(page_texts[2], ["Font 2"])
+            self.assertEqual(page_texts[3], page_texts[1])
+            # The crops of all pages go through a single recognizer call, and repeated pages are read once.
+            self.assertEqual(reader.recognize.call_count, 1)
+            self.assertEqual(reader.detect.call_count, 1)
+
+            # Pages already read are not read again.
+            self.assertEqual(fonts.read_pdf_page_texts(pdf_path), page_texts)
+            self.assertEqual(reader.recognize.call_count, 1)
+            self.assertEqual(fonts.match_font_names(page_texts[0], {"Inter", "Lexend", "Arial"}), {"Inter", "Lexend"})
+
+    @patch.dict('app.utils.fonts._page_text_cache', clear=True)
+    def test_pdf_page_texts_of_form_xobject_pages(self):
+        def imported_kit(path, texts):
+            source = fitz.open()
+            for text in texts:
+                source.new_page().insert_text((50, 60), text)
+            doc = fitz.open()
+            for page_number in range(len(texts)):
+                # The page content stream only draws a Form XObject, the same for every page and kit
+                doc.new_page().show_pdf_page(fitz.Rect(0, 0, 595, 842), source, page_number)
+            doc.save(path)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            imported_kit(os.path.join(tmp, "a.pdf"), ["Typography: Inter", "Colors"])
+            imported_kit(os.path.join(tmp, "b.pdf"), ["Typography: Lexend", "Logo"])
+            self.assertEqual(fonts.read_pdf_page_texts(os.path.join(tmp, "a.pdf")), [["Typography: Inter"], ["Colors"]])
+            self.assertEqual(fonts.read_pdf_page_texts(os.path.join(tmp, "b.pdf")), [["Typography: Lexend"], ["Logo"]])
+
+    def test_page_rasters_are_read_only_views(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "kit.pdf")
+            doc = fitz.open()
+            doc.new_page().draw_rect(fitz.Rect(10, 10, 100, 100), color=None, fill=(1, 0, 0))
+            doc.new_page()
+            doc.save(pdf_path)
+
+            doc = fitz.open(pdf_path)
+            pix = doc[0].get_pixmap(colorspace=fitz.csRGB, alpha=False)
+            raster = rasters.render_page(doc[0])
+            self.assertFalse(raster.array.flags.writeable)
+            self.assertFalse(raster.array.flags.owndata)
+            self.assertEqual(raster.array.tobytes(), pix.samples)
+            self.assertEqual(rasters.render_page(doc[0], mode="L").to_image().mode, "L")
+
+            store = rasters.PageStore()
+            first = [raster for _, raster in store.iter_pages(pdf_path)]
+            second = [raster for _, raster in store.iter_pages(pdf_path)]
+            self.assertIs(first[0], second[0])
+            self.assertIn("#ff0000", colors.extract_colors_from_pdf(pdf_path))
+
+    def test_loadtest_corpus_and_percentiles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest_path = os.path.join(tmp, "pairs.txt")
+            with open(manifest_path, "w") as manifest:
+                manifest.write("slides/a.png, kits/acme.pdf\n# comment\n\nb.jpg,acme.pdf\n")
+            self.assertEqual(loadtest.load_corpus(manifest_path), [
+                (os.path.join(tmp, "slides/a.png"), os.path.join(tmp, "kits/acme.pdf")),
+                (os.path.join(tmp, "b.jpg"), os.path.join(tmp, "acme.pdf")),
+            ])
+        latencies = [float(i) for i in range(1, 101)]
+        self.assertEqual(loadtest.percentile(latencies, 50), 50.0)
+        self.assertEqual(loadtest.percentile(latencies, 99), 99.0)
+        self.assertIsNone(loadtest.percentile([], 95))
+
+    @patch.dict(os.environ)
+    @patch.object(colors, 'analyze_colors', colors.analyze_colors)
+    @patch.object(logo_colors, 'check_logo_colors', logo_colors.check_logo_colors)
+    @patch.object(logo_position, 'check_logo_position', logo_position.check_logo_position)
+    @patch.object(fonts, 'verify_fonts', fonts.verify_fonts)
+    def test_loadtest_level_against_stand_ins(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                Image.new("RGB", (64, 48), (200, 30, 30)).save("slide.png")
+                kit = fitz.open()
+                kit.new_page().insert_text((50, 60), "Primary colors #C81E1E")
+                kit.save("kit.pdf")
+
+                loadtest.install_stand_in_models(0.01)
+                self.assertEqual(os.environ["BRAND_CHECK_SKIP_MODELS"], "1")
+                url, server, thread = loadtest.start_local_server()
+                try:
+                    level = loadtest.run_level(url, [("slide.png", "kit.pdf")], 2, 4, "off", None)
+                finally:
+                    server.should_exit = True
+                    thread.join()
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(level["requests"], 4)
+        self.assertEqual(level["error_rate"], 0)
+        self.assertIsNotNone(level["p95_s"])
+
 if __name__ == '__main__':
     unittest.main()